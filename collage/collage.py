@@ -0,0 +1,345 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+# Insiemi di immagini da generare per ciascun soggetto: cartella di output,
+# colore dello sfondo e intervallo degli oggetti (indici da 1 a 400)
+COLLAGE_SETS = [
+    ("old_orange", "orange", (1, 100)),
+    ("old_white", "white", (101, 200)),
+    ("new_orange", "orange", (201, 300)),
+    ("new_white", "white", (301, 400)),
+]
+
+# Versione della regola di posizionamento degli oggetti: va incrementata
+# quando cambia placement(), così le build incrementali rigenerano tutto
+PLACEMENT_RULE = 1
+
+MANIFEST_NAME = "collage_manifest.json"
+LOG_NAME = "collage_log.txt"
+
+# "<percorso del collage>: <oggetto>", eventualmente seguito da " (<tempo> ms)"
+LOG_LINE = re.compile(r"^(?P<path>.+?): (?P<object>.+?)(?: \((?P<ms>[\d.]+) ms\))?$")
+
+# Sfondo decodificato nel processo worker corrente (solo l'ultimo: i lavori
+# arrivano a blocchi con lo stesso sfondo, e tenerli tutti farebbe crescere la
+# memoria con ogni soggetto)
+_background = (None, None)
+
+
+def _load_background(background_path):
+    global _background
+    if _background[0] != background_path:
+        background = Image.open(background_path)
+        background.load()
+        _background = (background_path, background)
+    return _background[1]
+
+
+# Elenco ordinato delle immagini degli oggetti (l'ordine di os.listdir non è
+# garantito, quindi lo stesso intervallo darebbe oggetti diversi)
+def list_objects(objects_folder):
+    return sorted(img for img in os.listdir(objects_folder) if img.endswith(".png"))
+
+
+# Calcola dimensione e posizione dell'oggetto sullo sfondo
+def placement(background_size, object_size, rng):
+    background_width, background_height = background_size
+    obj_width, obj_height = object_size
+
+    # Dimensione ridotta degli oggetti (circa 2/5 della larghezza del background)
+    object_target_width = background_width // 2.5
+    scaling_factor = object_target_width / obj_width
+    new_obj_width = int(obj_width * scaling_factor)
+    new_obj_height = int(obj_height * scaling_factor)
+
+    # L'altezza non può essere più di 1.25 volte la larghezza
+    if new_obj_height > 1.25 * new_obj_width:
+        new_obj_height = int(1.25 * new_obj_width)
+        scaling_factor = new_obj_height / obj_height
+        new_obj_width = int(obj_width * scaling_factor)
+
+    # Oggetto a sinistra o a destra, con altezza y circa 1/4 dell'altezza
+    # totale dal basso, senza uscire dai bordi dello sfondo
+    x_position = rng.choice([0, background_width - new_obj_width])
+    y_position = background_height - int(background_height / 4) - new_obj_height
+    y_position = min(y_position, background_height - new_obj_height)
+
+    return (new_obj_width, new_obj_height), (x_position, y_position)
+
+
+# Crea un singolo collage (eseguito nei processi worker). Restituisce il
+# percorso del file creato, il nome dell'oggetto e il tempo impiegato in ms.
+def make_collage(job):
+    background_path, object_path, collage_path, seed = job
+    start_time = time.perf_counter()
+    rng = random.Random(f"{seed}:{collage_path}") if seed is not None else random
+
+    background = _load_background(background_path)
+    with Image.open(object_path) as obj:
+        new_obj_size, position = placement(background.size, obj.size, rng)
+        obj = obj.resize(new_obj_size)
+        collage = background.copy()
+        # Incolla l'oggetto sul background con trasparenza
+        collage.paste(obj, position, obj)
+        collage.save(collage_path)
+
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+    return collage_path, os.path.basename(object_path), elapsed_ms
+
+
+# Prepara i lavori di un insieme di collage (una cartella di output)
+def collage_jobs(
+    background_path, objects_folder, output_folder, image_range, prefix, seed=None
+):
+    if not os.path.exists(background_path):
+        raise FileNotFoundError(
+            f"Background file '{background_path}' non trovato. Verifica il percorso."
+        )
+    if not os.path.exists(objects_folder):
+        raise FileNotFoundError(
+            f"La cartella '{objects_folder}' non esiste. Verifica il percorso."
+        )
+
+    selected_images = list_objects(objects_folder)[image_range[0] - 1 : image_range[1]]
+    if len(selected_images) < 1:
+        raise ValueError(
+            f"Non ci sono immagini sufficienti nell'intervallo {image_range}."
+        )
+
+    specific_output_folder = os.path.join(output_folder, prefix)
+    os.makedirs(specific_output_folder, exist_ok=True)
+    return [
+        (
+            background_path,
+            os.path.join(objects_folder, img),
+            os.path.join(specific_output_folder, f"{prefix}_img_{idx:03d}.png"),
+            seed,
+        )
+        for idx, img in enumerate(selected_images, 1)
+    ]
+
+
+# Hash del contenuto di un file, calcolato una volta per percorso
+_file_hashes = {}
+
+
+def file_hash(path):
+    if path not in _file_hashes:
+        with open(path, "rb") as f:
+            _file_hashes[path] = hashlib.sha256(f.read()).hexdigest()
+    return _file_hashes[path]
+
+
+# Hash di tutto ciò che determina un collage: sfondo, oggetto e parametri di
+# posizionamento
+def job_hashes(job):
+    background_path, object_path, collage_path, seed = job
+    params = json.dumps(
+        {"rule": PLACEMENT_RULE, "seed": seed, "name": os.path.basename(collage_path)}
+    )
+    return {
+        "background": file_hash(background_path),
+        "object": file_hash(object_path),
+        "params": hashlib.sha256(params.encode("utf-8")).hexdigest(),
+    }
+
+
+# Voci di un collage_log.txt scritto dal notebook, che non ha un manifest:
+# l'oggetto di ogni collage è noto, gli hash dei suoi input no (hashes None)
+def read_log(folder):
+    entries = {}
+    log_path = os.path.join(folder, LOG_NAME)
+    if not os.path.exists(log_path):
+        return entries
+    with open(log_path) as log_file:
+        for line in log_file:
+            match = LOG_LINE.match(line.strip())
+            if match:
+                entries[os.path.basename(match["path"])] = {
+                    "object_name": match["object"],
+                    "hashes": None,
+                    "elapsed_ms": float(match["ms"]) if match["ms"] else None,
+                }
+    return entries
+
+
+# Il manifest di una cartella; se non esiste ancora (cartella creata dal
+# notebook) si parte dalle voci di collage_log.txt, così che riscrivendo il
+# log le immagini esistenti non perdano l'oggetto associato
+def load_manifest(folder):
+    manifest_path = os.path.join(folder, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return read_log(folder)
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+
+# Una cartella con collage di cui non si conoscono gli input (creati dal
+# notebook, con gli oggetti nell'ordine di os.listdir)
+def is_legacy(manifest):
+    return any(entry["hashes"] is None for entry in manifest.values())
+
+
+# Il manifest associa a ogni collage gli hash dei suoi input, l'oggetto usato
+# e il tempo impiegato; collage_log.txt ne è la versione leggibile
+def write_manifest(folder, manifest):
+    with open(os.path.join(folder, MANIFEST_NAME), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    with open(os.path.join(folder, LOG_NAME), "w") as log_file:
+        for name in sorted(manifest):
+            entry = manifest[name]
+            line = f"{os.path.join(folder, name)}: {entry['object_name']}"
+            if entry["elapsed_ms"] is not None:
+                line += f" ({entry['elapsed_ms']:.1f} ms)"
+            log_file.write(line + "\n")
+
+
+# Esegue i lavori su un pool di processi e aggiorna il manifest e
+# collage_log.txt di ogni cartella di output. In modalità incrementale
+# rigenera solo i collage i cui input (hash di sfondo, oggetto e parametri)
+# sono cambiati o il cui file manca. Restituisce il numero di collage creati,
+# già aggiornati e non riusciti.
+def run_jobs(jobs, workers=None, incremental=False):
+    manifests = {}
+    pending = []
+    for job in jobs:
+        folder, name = os.path.split(job[2])
+        if folder not in manifests:
+            manifests[folder] = load_manifest(folder)
+        hashes = job_hashes(job)
+        entry = manifests[folder].get(name)
+        if (
+            incremental
+            and entry is not None
+            and entry["hashes"] == hashes
+            and os.path.exists(job[2])
+        ):
+            continue
+        pending.append((job, hashes))
+
+    built = failed = 0
+    if pending:
+        n_workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # I lavori sono ordinati per sfondo, così ogni worker riceve blocchi
+            # con lo stesso sfondo e lo decodifica una volta sola
+            chunksize = max(1, len(pending) // (4 * n_workers))
+            results = executor.map(
+                _safe_make_collage, [job for job, _ in pending], chunksize=chunksize
+            )
+            for (job, hashes), result in zip(pending, results):
+                if result is None:
+                    failed += 1
+                    continue
+                collage_path, object_name, elapsed_ms = result
+                folder, name = os.path.split(collage_path)
+                manifests[folder][name] = {
+                    "object_name": object_name,
+                    "hashes": hashes,
+                    "elapsed_ms": round(elapsed_ms, 1),
+                }
+                built += 1
+
+    for folder, manifest in manifests.items():
+        write_manifest(folder, manifest)
+    return built, len(jobs) - len(pending), failed
+
+
+def _safe_make_collage(job):
+    try:
+        return make_collage(job)
+    except Exception as e:
+        print(f"Errore durante la gestione del file {job[1]}: {e}")
+        return None
+
+
+# Stessa interfaccia della funzione del notebook, ma i collage sono creati
+# in parallelo
+def create_collages_based_on_background(
+    background_path,
+    objects_folder,
+    output_folder,
+    image_range,
+    prefix,
+    seed=None,
+    incremental=False,
+):
+    jobs = collage_jobs(
+        background_path, objects_folder, output_folder, image_range, prefix, seed
+    )
+    return run_jobs(jobs, incremental=incremental)
+
+
+# Lavori per tutti e quattro gli insiemi old/new x orange/white di un soggetto
+def subject_jobs(backgrounds_folder, objects_folder, output_folder, seed=None):
+    jobs = []
+    for prefix, color, image_range in COLLAGE_SETS:
+        background_path = os.path.join(backgrounds_folder, f"background_{color}.png")
+        jobs += collage_jobs(
+            background_path, objects_folder, output_folder, image_range, prefix, seed
+        )
+    return jobs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Crea i collage old/new x orange/white per uno o più soggetti"
+    )
+    parser.add_argument("--objects-folder", default="objects_folder")
+    parser.add_argument("--output-folder", default="output_folder")
+    parser.add_argument(
+        "--subjects-folder",
+        help="cartella con una sottocartella per soggetto, ciascuna con "
+        "background_orange.png e background_white.png (default: gli sfondi "
+        "nella cartella corrente)",
+    )
+    parser.add_argument("--workers", type=int, help="numero di processi")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="rigenera solo i collage con sfondo, oggetto o parametri cambiati",
+    )
+    parser.add_argument(
+        "--seed", help="rende riproducibile la posizione degli oggetti"
+    )
+    args = parser.parse_args()
+
+    if args.subjects_folder:
+        subjects = [
+            (
+                os.path.join(args.subjects_folder, name),
+                os.path.join(args.output_folder, name),
+            )
+            for name in sorted(os.listdir(args.subjects_folder))
+            if os.path.isdir(os.path.join(args.subjects_folder, name))
+        ]
+    else:
+        subjects = [(".", args.output_folder)]
+
+    start_time = time.time()
+    try:
+        jobs = []
+        for backgrounds_folder, output_folder in subjects:
+            jobs += subject_jobs(
+                backgrounds_folder, args.objects_folder, output_folder, args.seed
+            )
+    except (FileNotFoundError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+
+    built, skipped, failed = run_jobs(jobs, args.workers, args.incremental)
+    print(
+        f"{built} collage creati, {skipped} già aggiornati, "
+        f"in {time.time() - start_time:.1f} s"
+    )
+    if failed:
+        print(f"{failed} collage non riusciti")
+        sys.exit(1)
@@ -0,0 +1,147 @@
+import argparse
+import os
+import sys
+import time
+from collage import COLLAGE_SETS, is_legacy, load_manifest, run_jobs, subject_jobs
+
+COLLAGE_FOLDER = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OBJECTS_FOLDER = os.path.join(COLLAGE_FOLDER, "objects_folder")
+DEFAULT_IMAGES_FOLDER = os.path.join(COLLAGE_FOLDER, "..", "prl_task_v_02", "images")
+IMAGES_PER_FOLDER = 100
+
+
+# Controlla che una cartella di soggetto (es. images/subject_1_self) abbia la
+# struttura che si aspettano prl_30.load_images e load_images_from_folder dei
+# compiti di memoria: in ogni sottocartella <prefix>_img_001.png ...
+# <prefix>_img_100.png e nessun altro file PNG. Restituisce i problemi trovati.
+def validate_subject_folder(subject_folder):
+    problems = []
+    for prefix, _, _ in COLLAGE_SETS:
+        folder = os.path.join(subject_folder, prefix)
+        if not os.path.isdir(folder):
+            problems.append(f"{folder}: cartella mancante")
+            continue
+        expected = {
+            f"{prefix}_img_{i:03d}.png" for i in range(1, IMAGES_PER_FOLDER + 1)
+        }
+        found = {f for f in os.listdir(folder) if f.endswith(".png")}
+        missing = sorted(expected - found)
+        unexpected = sorted(found - expected)
+        if missing:
+            problems.append(
+                f"{folder}: {len(missing)} immagini mancanti ({missing[0]}, ...)"
+            )
+        if unexpected:
+            problems.append(
+                f"{folder}: {len(unexpected)} file inattesi ({unexpected[0]}, ...)"
+            )
+    return problems
+
+
+# Le foto di sfondo sono organizzate come le cartelle di images/: una cartella
+# <soggetto>_self e una <soggetto>_stranger, ciascuna con background_orange.png
+# e background_white.png
+def find_subject_folders(photos_folder):
+    return [
+        name
+        for name in sorted(os.listdir(photos_folder))
+        if os.path.isdir(os.path.join(photos_folder, name))
+        and (name.endswith("_self") or name.endswith("_stranger"))
+    ]
+
+
+# Lavori per le immagini mancanti di un soggetto: quelle esistenti potrebbero
+# essere già state mostrate al soggetto e non vanno rigenerate. Un'immagine
+# già registrata nel manifest o nel log usa lo stesso oggetto di allora. Le
+# cartelle create dal notebook hanno gli oggetti nell'ordine di os.listdir,
+# non in quello di list_objects: lì un'immagine mancante non registrata
+# potrebbe ripetere un oggetto di un altro insieme (es. un "new" uguale a un
+# "old"), quindi non viene creata e il problema viene segnalato.
+def missing_jobs(subject_jobs_list, objects_folder):
+    manifests = {}
+    for job in subject_jobs_list:
+        folder = os.path.dirname(job[2])
+        if folder not in manifests:
+            manifests[folder] = load_manifest(folder)
+    legacy = any(is_legacy(manifest) for manifest in manifests.values())
+
+    jobs, problems = [], []
+    for background_path, object_path, collage_path, seed in subject_jobs_list:
+        if os.path.exists(collage_path):
+            continue
+        folder, name = os.path.split(collage_path)
+        entry = manifests[folder].get(name)
+        if entry is not None:
+            object_path = os.path.join(objects_folder, entry["object_name"])
+        elif legacy:
+            problems.append(
+                f"{collage_path}: oggetto sconosciuto in una cartella creata "
+                "senza manifest, immagine non creata"
+            )
+            continue
+        jobs.append((background_path, object_path, collage_path, seed))
+    return jobs, problems
+
+
+def provision(photos_folder, images_folder, objects_folder, workers=None, seed=None):
+    jobs = []
+    problems = []
+    for name in find_subject_folders(photos_folder):
+        output_folder = os.path.join(images_folder, name)
+        if os.path.isdir(output_folder) and not validate_subject_folder(output_folder):
+            print(f"{name}: già completo")
+            continue
+        subject_missing, subject_problems = missing_jobs(
+            subject_jobs(
+                os.path.join(photos_folder, name), objects_folder, output_folder, seed
+            ),
+            objects_folder,
+        )
+        jobs += subject_missing
+        problems += subject_problems
+
+    built, _, failed = run_jobs(jobs, workers)
+    print(f"{built} collage creati")
+    if failed:
+        problems.append(f"{failed} collage non riusciti")
+
+    # Validazione finale di tutte le cartelle dei soggetti
+    for name in find_subject_folders(photos_folder):
+        problems += validate_subject_folder(os.path.join(images_folder, name))
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Crea le cartelle di immagini di tutti i soggetti a partire "
+        "dalle foto di sfondo"
+    )
+    parser.add_argument(
+        "photos_folder",
+        help="cartella con le sottocartelle <soggetto>_self e <soggetto>_stranger",
+    )
+    parser.add_argument("--images-folder", default=DEFAULT_IMAGES_FOLDER)
+    parser.add_argument("--objects-folder", default=DEFAULT_OBJECTS_FOLDER)
+    parser.add_argument("--workers", type=int, help="numero di processi")
+    parser.add_argument(
+        "--seed", help="rende riproducibile la posizione degli oggetti"
+    )
+    args = parser.parse_args()
+
+    start_time = time.time()
+    try:
+        problems = provision(
+            args.photos_folder,
+            args.images_folder,
+            args.objects_folder,
+            args.workers,
+            args.seed,
+        )
+    except (FileNotFoundError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+
+    for problem in problems:
+        print(problem)
+    print(f"Completato in {time.time() - start_time:.1f} s")
+    sys.exit(1 if problems else 0)
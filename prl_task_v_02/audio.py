@@ -0,0 +1,61 @@
+import time
+import pygame
+
+# Feedback sounds are decoded once at start-up and each one plays on its own
+# reserved mixer channel, so feedback onset never waits for a WAV file to be
+# read and never has to find a free channel. The mixer runs with a small
+# buffer: the sound card gets each new sound after at most BUFFER_SIZE samples
+# instead of pygame's default 512 (about 12 ms at 44.1 kHz).
+FREQUENCY = 44100
+BUFFER_SIZE = 256
+
+FEEDBACK_SOUNDS = {
+    "pleasant": "beeps/pleasant.wav",
+    "unpleasant": "beeps/unpleasant.wav",
+}
+
+
+# Must run before pygame.init() (or pygame.mixer.init()), which opens the
+# audio device with these settings
+def pre_init(buffer=BUFFER_SIZE):
+    pygame.mixer.pre_init(frequency=FREQUENCY, size=-16, channels=2, buffer=buffer)
+
+
+# Time the mixer buffer adds before a sound reaches the sound card, in ms
+def buffer_latency_ms(buffer=BUFFER_SIZE):
+    frequency = pygame.mixer.get_init()[0] if pygame.mixer.get_init() else FREQUENCY
+    return buffer / frequency * 1000
+
+
+class FeedbackSounds:
+    def __init__(self, files=FEEDBACK_SOUNDS):
+        self.sounds = {name: pygame.mixer.Sound(path) for name, path in files.items()}
+        # Channels 0..n-1 are left alone by Sound.play() and find_channel()
+        pygame.mixer.set_reserved(len(self.sounds))
+        self.channels = {
+            name: pygame.mixer.Channel(i) for i, name in enumerate(self.sounds)
+        }
+        self.latency_ms = buffer_latency_ms()
+
+    # Start a sound, cutting off the previous one on its channel. Returns the
+    # time.perf_counter_ns() timestamp taken when the mixer got the sound.
+    def play(self, name):
+        self.channels[name].play(self.sounds[name])
+        return time.perf_counter_ns()
+
+    # Estimated audio onset relative to a visual onset (both in ns), in ms:
+    # the time from the flip to play() plus the mixer buffer
+    def onset_latency(self, played_ns, visual_onset_ns):
+        return (played_ns - visual_onset_ns) / 1e6 + self.latency_ms
+
+
+# The feedback sounds of the process, shared by the tasks run in it (until
+# the mixer is closed)
+_feedback_sounds = None
+
+
+def get_feedback_sounds():
+    global _feedback_sounds
+    if _feedback_sounds is None or not pygame.mixer.get_init():
+        _feedback_sounds = FeedbackSounds()
+    return _feedback_sounds
@@ -0,0 +1,257 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pygame
+import headless
+import prl_30
+from prl_schedule import FIELDNAMES
+from trial_logger import TrialLogger
+from video_player import play_video_file
+
+# Latency of each stage of the PRL presentation pipeline, measured on the
+# real prl_30 functions with SDL's dummy drivers and a headless responder
+# (so response waits and fixation intervals take no time and only the
+# drawing, flipping and bookkeeping are measured). For each stage the
+# p50/p95/p99 latencies are reported, plus the memory allocated by one run
+# of the stage (tracemalloc, measured separately so it does not slow down
+# the timed runs). Loading the images takes over half a second, too long to
+# repeat it enough times for percentiles, so it is timed once, as a
+# wall-clock value that is reported but not checked for regressions. Results
+# can be saved under a label in a JSON baseline and compared with an earlier
+# label:
+#
+#   python3 benchmark.py --label prl_30 --save
+#   python3 benchmark.py --label my_change --compare prl_30
+BASELINE_FILE = "benchmark_baseline.json"
+
+# A stage is reported as slower when its p50 or p95 grows by more than this
+# fraction and by more than REGRESSION_MIN_MS (sub-millisecond stages are noisy)
+REGRESSION_THRESHOLD = 0.2
+REGRESSION_MIN_MS = 0.5
+
+
+def percentiles(samples):
+    ms = np.asarray(samples) * 1000
+    return {
+        "n": len(ms),
+        "mean": round(float(ms.mean()), 3),
+        "p50": round(float(np.percentile(ms, 50)), 3),
+        "p95": round(float(np.percentile(ms, 95)), 3),
+        "p99": round(float(np.percentile(ms, 99)), 3),
+    }
+
+
+def time_calls(function, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+# Memory allocated by one call: still allocated afterwards and at the peak
+def allocations(function):
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    function()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "allocated_kib": round((after - before) / 1024, 1),
+        "peak_kib": round((peak - before) / 1024, 1),
+    }
+
+
+# Time between successive flips while a function runs, i.e. per frame
+def frame_times(function):
+    flips = []
+    flip = pygame.display.flip
+
+    def timed_flip():
+        flip()
+        flips.append(time.perf_counter())
+
+    pygame.display.flip = timed_flip
+    try:
+        start = time.perf_counter()
+        function()
+    finally:
+        pygame.display.flip = flip
+    return list(np.diff([start] + flips))
+
+
+def run_benchmark(subject_code, condition_code, repeats, n_videos, paced):
+    results = {}
+    headless.start("random", seed=0)
+    prl_30.setup_display({})
+    prl_30.video_cache = None
+    prl_30.reward_probabilities = prl_30.epoch_reward_probabilities(True)
+
+    def stage(name, samples, function=None):
+        results[name] = percentiles(samples)
+        if function is not None:
+            results[name].update(allocations(function))
+        r = results[name]
+        print(
+            f"{name:<16} n={r['n']:<5} p50={r['p50']:8.3f} "
+            f"p95={r['p95']:8.3f} p99={r['p99']:8.3f} ms"
+        )
+
+    def load():
+        return prl_30.load_images(subject_code, condition_code)
+
+    start = time.perf_counter()
+    orange_images, white_images, orange_files, white_files = load()
+    results["load_images"] = {
+        "wall_ms": round((time.perf_counter() - start) * 1000, 3),
+        **allocations(load),
+    }
+    print(f"{'load_images':<16} wall={results['load_images']['wall_ms']:8.3f} ms")
+
+    def fixation():
+        prl_30.display_fixation(0.5)
+
+    stage("fixation", time_calls(fixation, repeats), fixation)
+
+    def stimulus():
+        prl_30.display_images_and_get_response(
+            orange_images[0],
+            white_images[0],
+            orange_files[0],
+            white_files[0],
+            "Left",
+        )
+
+    stage("stimulus", time_calls(stimulus, repeats), stimulus)
+
+    def sound():
+        prl_30.feedback_sounds.play("pleasant")
+
+    stage("feedback_sound", time_calls(sound, repeats), sound)
+
+    # The slider is built once in setup_display(), so a call only resets and
+    # redraws it; the responder confirms a value after a frame or two
+    slider_calls = max(1, repeats // 10)
+    slider_frames = []
+    slider_samples = []
+    for _ in range(slider_calls):
+        start = time.perf_counter()
+        slider_frames += frame_times(prl_30.display_mood_slider)
+        slider_samples.append(time.perf_counter() - start)
+    stage("mood_slider", slider_samples, prl_30.display_mood_slider)
+    stage("mood_frame", slider_frames)
+
+    # Video frames: decode, upload and flip, paced like the experiment unless
+    # --unpaced is given
+    videos = sorted(glob.glob("surprise/*.mov") + glob.glob("nosurprise/*.mov"))
+    video_frames = []
+    fps = []
+    for video_path in videos[:n_videos]:
+        stamps = []
+        start = time.perf_counter()
+        stats = play_video_file(
+            prl_30.screen,
+            video_path,
+            on_frame=lambda: stamps.append(time.perf_counter()),
+            paced=paced,
+        )
+        if stats is None:
+            continue
+        video_frames += list(np.diff([start] + stamps))
+        fps.append(stats["frames"] / (time.perf_counter() - start))
+        results.setdefault("video", []).append({"file": video_path, **stats})
+    if video_frames:
+        stage("video_frame", video_frames)
+        results["video_fps"] = round(float(np.mean(fps)), 2)
+        print(f"{'video_fps':<16} {results['video_fps']:.2f}")
+
+    # Logging a trial: the time the trial loop is held up by log(), and the
+    # time close() needs to write and sync everything logged
+    row = {name: "x" for name in FIELDNAMES}
+    with tempfile.TemporaryDirectory() as folder:
+        logger = TrialLogger(os.path.join(folder, "trials.csv"), FIELDNAMES)
+        stage("log_trial", time_calls(lambda: logger.log(row), repeats))
+        start = time.perf_counter()
+        logger.close()
+        results["log_close_ms"] = round((time.perf_counter() - start) * 1000, 3)
+
+    pygame.quit()
+    return results
+
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def compare(results, baseline):
+    slower = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not isinstance(current, dict) or not isinstance(previous, dict):
+            continue
+        for key in ("p50", "p95"):
+            if previous.get(key) and key in current:
+                change = current[key] / previous[key] - 1
+                print(
+                    f"{name:<16} {key} {previous[key]:8.3f} -> "
+                    f"{current[key]:8.3f} ms ({change:+.0%})"
+                )
+                increase = current[key] - previous[key]
+                if change > REGRESSION_THRESHOLD and increase > REGRESSION_MIN_MS:
+                    slower.append(f"{name} {key}")
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Latency benchmark of the PRL presentation pipeline"
+    )
+    parser.add_argument("--subject", default="subject_1")
+    parser.add_argument("--condition", default="A")
+    parser.add_argument("--repeats", type=int, default=200, help="calls per stage")
+    parser.add_argument("--videos", type=int, default=1, help="videos to play")
+    parser.add_argument(
+        "--unpaced", action="store_true", help="play videos as fast as possible"
+    )
+    parser.add_argument("--label", default="prl_30", help="name of this run")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save", action="store_true", help="store under --label")
+    parser.add_argument("--compare", help="label to compare with")
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        args.subject, args.condition, args.repeats, args.videos, not args.unpaced
+    )
+    baselines = load_baselines(args.baseline)
+
+    slower = []
+    if args.compare:
+        if args.compare not in baselines:
+            sys.exit(f"No results for '{args.compare}' in {args.baseline}")
+        print(f"Compared with {args.compare}:")
+        slower = compare(results, baselines[args.compare]["stages"])
+
+    if args.save:
+        baselines[args.label] = {
+            "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "repeats": args.repeats,
+            "paced_video": not args.unpaced,
+            "stages": results,
+        }
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(baselines, baseline_file, indent=1, sort_keys=True)
+
+    if slower:
+        print("Slower than the baseline: " + ", ".join(slower))
+        sys.exit(1)
@@ -0,0 +1,191 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import pygame
+
+# A bundle packs all the stimuli of one subject into a single file:
+#
+#   magic (8 bytes) | raw pixels of each image, 64-byte aligned |
+#   JSON index | index offset and length (2 x uint64, little endian)
+#
+# Pixels are stored as 32-bit BGRA, the byte order of the usual 32-bit
+# display format, so the loader can create Surfaces directly over the
+# memory-mapped file without decoding anything. The index goes at the end
+# so that images can be written as they are decoded. The index also records
+# the modification time and size of each source PNG: an image whose PNG has
+# changed since the bundle was built is decoded from the PNG instead.
+BUNDLE_MAGIC = b"PRLBNDL1"
+PIXEL_FORMAT = "BGRA"
+ALIGNMENT = 64
+IMAGES_FOLDER = "images"
+SUBJECT_FOLDERS = ["self", "stranger"]
+STIMULUS_FOLDERS = ["old_orange", "old_white", "new_orange", "new_white"]
+
+
+def bundle_path(subject_code, images_folder=IMAGES_FOLDER):
+    return os.path.join(images_folder, f"{subject_code}.bundle")
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+# Decode all PNGs of a subject and write them into one bundle file
+def build_bundle(subject_code, images_folder=IMAGES_FOLDER):
+    path = bundle_path(subject_code, images_folder)
+    entries = {}
+    with open(path + ".tmp", "wb") as bundle_file:
+        bundle_file.write(BUNDLE_MAGIC)
+        for folder_type in SUBJECT_FOLDERS:
+            for stimulus_folder in STIMULUS_FOLDERS:
+                folder = os.path.join(
+                    images_folder, f"{subject_code}_{folder_type}", stimulus_folder
+                )
+                if not os.path.isdir(folder):
+                    continue
+                for filename in sorted(os.listdir(folder)):
+                    if not filename.endswith(".png"):
+                        continue
+                    source = os.path.join(folder, filename)
+                    stat = os.stat(source)
+                    image = pygame.image.load(source)
+                    offset = _align(bundle_file.tell())
+                    bundle_file.write(b"\0" * (offset - bundle_file.tell()))
+                    bundle_file.write(pygame.image.tostring(image, PIXEL_FORMAT))
+                    key = f"{subject_code}_{folder_type}/{stimulus_folder}/{filename}"
+                    entries[key] = {
+                        "offset": offset,
+                        "width": image.get_width(),
+                        "height": image.get_height(),
+                        "alpha": bool(image.get_flags() & pygame.SRCALPHA),
+                        "mtime_ns": stat.st_mtime_ns,
+                        "size": stat.st_size,
+                    }
+
+        index = json.dumps(
+            {"subject": subject_code, "format": PIXEL_FORMAT, "images": entries}
+        ).encode("utf-8")
+        index_offset = bundle_file.tell()
+        bundle_file.write(index)
+        bundle_file.write(struct.pack("<QQ", index_offset, len(index)))
+
+    if not entries:
+        os.remove(path + ".tmp")
+        raise FileNotFoundError(f"No images found for {subject_code}")
+    os.replace(path + ".tmp", path)  # Never leave a half-written bundle behind
+    return path, len(entries)
+
+
+# Read-only view of a bundle. Surfaces share memory with the mapped file, so
+# an image is only paged in from disk when it is first drawn.
+class StimulusBundle:
+    def __init__(self, path):
+        self.path = path
+        self.warned = False
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[: len(BUNDLE_MAGIC)] != BUNDLE_MAGIC:
+            raise ValueError(f"{path} is not a stimulus bundle")
+        index_offset, index_size = struct.unpack_from(
+            "<QQ", self.map, len(self.map) - 16
+        )
+        index = json.loads(self.map[index_offset : index_offset + index_size])
+        self.format = index["format"]
+        self.images = index["images"]
+        self.view = memoryview(self.map)
+
+    def __contains__(self, key):
+        return key in self.images
+
+    # Whether the image still matches its source PNG (same modification time
+    # and size as when the bundle was built). Warns once per bundle otherwise.
+    def is_current(self, key, source_path):
+        entry = self.images[key]
+        try:
+            stat = os.stat(source_path)
+        except OSError:
+            stat = None
+        if (
+            stat is not None
+            and entry.get("mtime_ns") == stat.st_mtime_ns
+            and entry.get("size") == stat.st_size
+        ):
+            return True
+        if not self.warned:
+            print(
+                f"Warning: images changed since {self.path} was built, "
+                "loading them from the PNG files (rebuild it with bundle.py)"
+            )
+            self.warned = True
+        return False
+
+    def surface(self, key):
+        entry = self.images[key]
+        size = (entry["width"], entry["height"])
+        start = entry["offset"]
+        surface = pygame.image.frombuffer(
+            self.view[start : start + size[0] * size[1] * 4], size, self.format
+        )
+        if not entry["alpha"]:
+            surface.set_alpha(None)  # Opaque image: blit without blending
+        return surface
+
+
+# Bundles opened so far, by path (None when a subject has no bundle)
+_bundles = {}
+
+
+def open_bundle(subject_code, images_folder=IMAGES_FOLDER):
+    path = bundle_path(subject_code, images_folder)
+    if path not in _bundles:
+        _bundles[path] = StimulusBundle(path) if os.path.exists(path) else None
+    return _bundles[path]
+
+
+# Split an image path like images/subject_1_self/old_orange/x.png into the
+# bundle that would hold it and the key of the image in that bundle
+def _locate(path):
+    parts = os.path.normpath(path).split(os.sep)
+    if len(parts) < 3:
+        return None, None
+    subject_folder = parts[-3]
+    for folder_type in SUBJECT_FOLDERS:
+        if subject_folder.endswith("_" + folder_type):
+            subject_code = subject_folder[: -len(folder_type) - 1]
+            images_folder = os.sep.join(parts[:-3]) or "."
+            return open_bundle(subject_code, images_folder), "/".join(parts[-3:])
+    return None, None
+
+
+# Return a stimulus from the subject's bundle when there is one and it is up
+# to date with the PNG, otherwise decode the PNG from disk
+def load_image(path):
+    bundle, key = _locate(path)
+    if bundle is not None and key in bundle and bundle.is_current(key, path):
+        return bundle.surface(key)
+    return pygame.image.load(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Pack the stimuli of each subject into one bundle file"
+    )
+    parser.add_argument("subject_codes", nargs="+", help="e.g. subject_1")
+    parser.add_argument("--images-folder", default=IMAGES_FOLDER)
+    args = parser.parse_args()
+
+    for subject_code in args.subject_codes:
+        start_time = time.time()
+        try:
+            path, n_images = build_bundle(subject_code, args.images_folder)
+        except (pygame.error, FileNotFoundError) as e:
+            print(f"Error building the bundle for {subject_code}: {e}")
+            sys.exit(1)
+        print(
+            f"{path}: {n_images} images, "
+            f"{os.path.getsize(path) / 2**20:.0f} MB in {time.time() - start_time:.1f} s"
+        )
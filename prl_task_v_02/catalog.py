@@ -0,0 +1,232 @@
+import argparse
+import json
+import os
+import re
+import time
+from bundle import IMAGES_FOLDER, SUBJECT_FOLDERS, STIMULUS_FOLDERS
+
+# Index of all the stimuli in images/, shared by prl_30.py and the memory
+# tasks. One scan of images/ records, for every PNG, its subject, self or
+# stranger folder, old or new set, colour and number, its mtime and size,
+# and the object pasted on it (from the collage_log.txt of its folder). The
+# index is saved as images/catalog.json together with the mtimes of the
+# folders and logs it was built from; at start-up only images/ itself is
+# listed and those few paths are stat'ed, and the images are scanned again
+# only when a subject folder appeared or disappeared or one of them changed
+# (adding, removing or renaming an image changes the mtime of its folder).
+#
+#   python3 catalog.py            # rebuild the index and print a summary
+CATALOG_NAME = "catalog.json"
+CATALOG_VERSION = 1
+LOG_NAME = "collage_log.txt"
+
+IMAGE_NUMBER = re.compile(r"(\d+)\.png$")
+
+# "<collage path>: <object file>", optionally followed by " (<time> ms)"
+LOG_LINE = re.compile(r"^(?P<path>.+?): (?P<object>.+?)(?: \([\d.]+ ms\))?$")
+
+
+def catalog_path(images_folder=IMAGES_FOLDER):
+    return os.path.join(images_folder, CATALOG_NAME)
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+# Split "subject_1_self" into ("subject_1", "self")
+def _split_subject_folder(name):
+    for folder_type in SUBJECT_FOLDERS:
+        if name.endswith("_" + folder_type):
+            return name[: -len(folder_type) - 1], folder_type
+    return None, None
+
+
+# Object pasted on each collage of a folder, by file name
+def read_collage_log(log_path):
+    objects = {}
+    if not os.path.exists(log_path):
+        return objects
+    with open(log_path) as log_file:
+        for line in log_file:
+            match = LOG_LINE.match(line.strip())
+            if match:
+                objects[os.path.basename(match["path"])] = match["object"]
+    return objects
+
+
+# Subject folders in images/, e.g. "subject_1_self"
+def subject_folders(images_folder=IMAGES_FOLDER):
+    return sorted(
+        name
+        for name in os.listdir(images_folder)
+        if _split_subject_folder(name)[0] is not None
+        and os.path.isdir(os.path.join(images_folder, name))
+    )
+
+
+# Scan images/ and return the index: the images by their path relative to
+# images_folder, and the mtimes of every folder and log that was read. (The
+# mtime of images/ itself is not used: saving the catalog changes it.)
+def build_index(images_folder=IMAGES_FOLDER):
+    images = {}
+    sources = {}
+    for subject_folder in subject_folders(images_folder):
+        subject_code, folder_type = _split_subject_folder(subject_folder)
+        subject_path = os.path.join(images_folder, subject_folder)
+        sources[subject_path] = _mtime(subject_path)
+        for stimulus_folder in STIMULUS_FOLDERS:
+            folder = os.path.join(subject_path, stimulus_folder)
+            if not os.path.isdir(folder):
+                continue
+            log_path = os.path.join(folder, LOG_NAME)
+            sources[folder] = _mtime(folder)
+            sources[log_path] = _mtime(log_path)
+            objects = read_collage_log(log_path)
+            image_set, color = stimulus_folder.split("_")
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(".png"):
+                        continue
+                    stat = entry.stat()
+                    match = IMAGE_NUMBER.search(entry.name)
+                    images[f"{subject_folder}/{stimulus_folder}/{entry.name}"] = {
+                        "subject": subject_code,
+                        "folder_type": folder_type,
+                        "set": image_set,
+                        "color": color,
+                        "index": int(match.group(1)) if match else None,
+                        "mtime": stat.st_mtime_ns,
+                        "size": stat.st_size,
+                        "object": objects.get(entry.name),
+                    }
+    return {
+        "version": CATALOG_VERSION,
+        "subject_folders": subject_folders(images_folder),
+        "sources": sources,
+        "images": images,
+    }
+
+
+def _is_current(index, images_folder):
+    return (
+        index.get("version") == CATALOG_VERSION
+        and index["subject_folders"] == subject_folders(images_folder)
+        and all(_mtime(path) == mtime for path, mtime in index["sources"].items())
+    )
+
+
+def save_index(index, images_folder=IMAGES_FOLDER):
+    path = catalog_path(images_folder)
+    # Sessions may start in parallel: write a private file and swap it in
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as catalog_file:
+        json.dump(index, catalog_file, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+# The saved index if it is still current, otherwise a fresh one (saved for
+# the next start-up)
+def load_index(images_folder=IMAGES_FOLDER, rebuild=False):
+    path = catalog_path(images_folder)
+    if not rebuild and os.path.exists(path):
+        try:
+            with open(path) as catalog_file:
+                index = json.load(catalog_file)
+            if _is_current(index, images_folder):
+                return index
+        except (ValueError, KeyError):
+            pass  # Unreadable index: build a new one
+    index = build_index(images_folder)
+    try:
+        save_index(index, images_folder)
+    except OSError as e:
+        print(f"Could not save the stimulus catalog: {e}")
+    return index
+
+
+class Catalog:
+    def __init__(self, index, images_folder=IMAGES_FOLDER):
+        self.images_folder = images_folder
+        self.entries = index["images"]
+        # File names by (subject folder, stimulus folder): a list sorted by
+        # number, and a dict by number
+        self.folders = {}
+        self.numbered = {}
+        for key in sorted(self.entries):
+            subject_folder, stimulus_folder, filename = key.split("/")
+            folder = (subject_folder, stimulus_folder)
+            index = self.entries[key]["index"]
+            self.folders.setdefault(folder, []).append((index, filename))
+            if index is not None:
+                self.numbered.setdefault(folder, {})[index] = filename
+
+    def path(self, subject_folder, stimulus_folder, filename):
+        return os.path.join(
+            self.images_folder, subject_folder, stimulus_folder, filename
+        )
+
+    # File names of a folder, e.g. ("subject_1_self", "old_orange"), by number.
+    # With start and end, only the images numbered start..end.
+    def filenames(self, subject_folder, stimulus_folder, start=None, end=None):
+        entries = self.folders.get((subject_folder, stimulus_folder), [])
+        if start is None:
+            return [filename for _, filename in entries]
+        return [
+            filename
+            for index, filename in entries
+            if index is not None and start <= index <= end
+        ]
+
+    # File name of the image with a given number; FileNotFoundError if the
+    # catalog has no such image
+    def filename(self, subject_folder, stimulus_folder, index):
+        filename = self.numbered.get((subject_folder, stimulus_folder), {}).get(index)
+        if filename is not None:
+            return filename
+        raise FileNotFoundError(
+            f"No image {index} in {self.path(subject_folder, stimulus_folder, '')}"
+        )
+
+    # Object pasted on an image (None if its collage log does not list it)
+    def object_id(self, subject_folder, stimulus_folder, filename):
+        entry = self.entries.get(f"{subject_folder}/{stimulus_folder}/{filename}")
+        return entry["object"] if entry else None
+
+
+# Catalogs loaded so far, by images folder
+_catalogs = {}
+
+
+def get_catalog(images_folder=IMAGES_FOLDER):
+    if images_folder not in _catalogs:
+        _catalogs[images_folder] = Catalog(load_index(images_folder), images_folder)
+    return _catalogs[images_folder]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rebuild the index of the stimuli in the images folder"
+    )
+    parser.add_argument("--images-folder", default=IMAGES_FOLDER)
+    args = parser.parse_args()
+
+    start_time = time.time()
+    index = load_index(args.images_folder, rebuild=True)
+    catalog = Catalog(index, args.images_folder)
+    print(
+        f"{catalog_path(args.images_folder)}: {len(index['images'])} images "
+        f"in {time.time() - start_time:.2f} s"
+    )
+    for (subject_folder, stimulus_folder), entries in sorted(catalog.folders.items()):
+        with_objects = sum(
+            catalog.object_id(subject_folder, stimulus_folder, filename) is not None
+            for _, filename in entries
+        )
+        print(
+            f"  {subject_folder}/{stimulus_folder}: {len(entries)} images, "
+            f"{with_objects} with an object"
+        )
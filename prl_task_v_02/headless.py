@@ -0,0 +1,273 @@
+import argparse
+import csv
+import glob
+import os
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import pygame
+from responses import set_responder
+from prl_schedule import (
+    N_EPOCHS,
+    TRIALS_PER_EPOCH,
+    IMAGE_RANGES,
+    most_rewarded_stimulus,
+    is_video_trial,
+    is_mood_trial,
+)
+
+# Headless runs of the real tasks: SDL's dummy video and audio drivers stand
+# in for the screen and sound card, and a responder answers every prompt at
+# once instead of the keyboard, so waits and video pacing are skipped and a
+# session runs as fast as it can while still writing the real CSV files.
+#
+#   python3 prl_30.py subject_1 A T --headless --responder=random --seed=1
+#   python3 memory_task_02.py subject_1 A --headless --responder=script:fjj
+#
+# Run as a script, this module runs batches of such sessions in separate
+# processes and checks the files they write.
+TASK_FOLDER = os.path.dirname(os.path.abspath(__file__))
+CONDITIONS = ["A", "B", "C", "D"]
+
+
+# Must run before pygame.init(), which picks the drivers
+def enable():
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+
+# Presses one of the accepted keys at random
+class RandomResponder:
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+
+    def __call__(self, keys):
+        return self.rng.choice(list(keys))
+
+
+# Presses the keys of a script in turn, e.g. "ffj" presses f, f, j, f, ...
+# When the next key of the script is not accepted (e.g. the space bar that
+# confirms the mood slider), the first accepted key is pressed instead.
+class ScriptedResponder:
+    def __init__(self, script):
+        self.script = [getattr(pygame, f"K_{name}") for name in script]
+        self.position = 0
+
+    def __call__(self, keys):
+        key = self.script[self.position % len(self.script)]
+        if key not in keys:
+            return list(keys)[0]
+        self.position += 1
+        return key
+
+
+# "random" or "script:<keys>"
+def make_responder(spec, seed=None):
+    if spec.startswith("script:"):
+        return ScriptedResponder(spec[len("script:") :])
+    if spec == "random":
+        return RandomResponder(seed)
+    raise ValueError(f"Unknown responder '{spec}'")
+
+
+def start(spec="random", seed=None):
+    enable()
+    set_responder(make_responder(spec, seed))
+
+
+# Check a PRL session file against the schedule: trial and epoch numbers,
+# reversal, counterbalancing, video and mood slider placement, a distinct
+# image pair in every trial of an epoch and choices consistent with the keys
+def check_prl_session(path, orange_first, condition_code):
+    problems = []
+    with open(path, newline="") as file:
+        rows = list(csv.DictReader(file))
+    n_trials = N_EPOCHS * TRIALS_PER_EPOCH
+    if len(rows) != n_trials:
+        problems.append(f"{len(rows)} trials instead of {n_trials}")
+
+    start, end = IMAGE_RANGES[condition_code]
+    pairs = {}
+    for n, row in enumerate(rows, 1):
+        epoch = (n - 1) // TRIALS_PER_EPOCH
+        trial = (n - 1) % TRIALS_PER_EPOCH
+        where = f"trial {n}"
+        if row["Trial Number"] != str(n) or row["Epoch"] != str(epoch + 1):
+            problems.append(
+                f"{where}: trial/epoch {row['Trial Number']}/{row['Epoch']}"
+            )
+        if row["Orange First"] != str(orange_first):
+            problems.append(f"{where}: Orange First is {row['Orange First']}")
+        if row["Most Rewarded Stimulus in Epoch"] != most_rewarded_stimulus(
+            epoch, orange_first
+        ):
+            problems.append(f"{where}: wrong most rewarded stimulus")
+        if bool(row["Video File Name"]) and not is_video_trial(trial):
+            problems.append(f"{where}: video outside the video trials")
+        if bool(row["Mood Slider Value"]) != is_mood_trial(n):
+            problems.append(f"{where}: mood slider placement")
+
+        key_pressed = row["Key Pressed"]
+        chosen = row["Image Left"] if key_pressed == "Left" else row["Image Right"]
+        if row["Chosen Image"] != chosen:
+            problems.append(f"{where}: chosen image does not match the key")
+        orange_side = row["Stimulus Position"]
+        chosen_color = "Orange" if key_pressed == orange_side else "White"
+        if row["Chosen Color"] != chosen_color:
+            problems.append(f"{where}: chosen color does not match the key")
+
+        image = row["Image Left"] if orange_side == "Left" else row["Image Right"]
+        index = int(image[-7:-4])
+        first = start + epoch * TRIALS_PER_EPOCH
+        if not first <= index < min(first + TRIALS_PER_EPOCH, end + 1):
+            problems.append(f"{where}: image {image} outside epoch {epoch + 1}")
+        pairs.setdefault(epoch, set()).add(index)
+
+    for epoch, indices in pairs.items():
+        if len(indices) != TRIALS_PER_EPOCH:
+            problems.append(f"epoch {epoch + 1}: {len(indices)} distinct images")
+    return problems
+
+
+# Check a memory session file: every old image shown once, paired with a new
+# image of the same colour (each new image at most once, as there are as many
+# new images as old ones), and Correct consistent with the key pressed
+def check_memory_session(path, condition_code):
+    problems = []
+    with open(path, newline="") as file:
+        rows = list(csv.DictReader(file))
+    start, end = IMAGE_RANGES[condition_code]
+    n_trials = 2 * (end - start + 1)
+    if len(rows) != n_trials:
+        problems.append(f"{len(rows)} trials instead of {n_trials}")
+
+    old_images = [row["Old Image"] for row in rows]
+    if len(set(old_images)) != len(old_images):
+        problems.append("old images shown more than once")
+    new_images = [row["New Image"] for row in rows]
+    if len(set(new_images)) != len(new_images):
+        problems.append("new images shown more than once")
+    for n, row in enumerate(rows, 1):
+        old_color = row["Old Image"].split("_")[1]
+        new_color = row["New Image"].split("_")[1]
+        if old_color != new_color:
+            problems.append(f"trial {n}: {row['Old Image']} with {row['New Image']}")
+        correct = row["Key Pressed"] == row["Old Image Side"]
+        if row["Correct"] != str(correct):
+            problems.append(f"trial {n}: Correct does not match the key")
+    return problems
+
+
+# Run one session in its own process, writing into folder, and check it.
+# Returns the time it took and the problems found.
+def run_session(session, responder="random", timeout=None):
+    task, subject_code, condition_code, orange_first, seed, folder = session
+    os.makedirs(folder, exist_ok=True)
+    flags = [
+        "--headless",
+        f"--responder={responder}",
+        f"--seed={seed}",
+        f"--output-folder={os.path.abspath(folder)}",
+    ]
+    if task == "prl":
+        orange_first_arg = "T" if orange_first else "F"
+        command = ["prl_30.py", subject_code, condition_code, orange_first_arg]
+        pattern = "experiment_data_*.csv"
+    else:
+        command = ["memory_task_02.py", subject_code, condition_code]
+        pattern = "memory_task_*.csv"
+
+    start_time = time.time()
+    completed = subprocess.run(
+        [sys.executable, *command, *flags],
+        cwd=TASK_FOLDER,
+        capture_output=True,
+        text=True,
+        timeout=timeout,
+    )
+    elapsed = time.time() - start_time
+    if completed.returncode != 0:
+        error = completed.stderr.strip().splitlines()[-1:] or [""]
+        return elapsed, [f"exit code {completed.returncode}: {error[0]}"]
+
+    files = glob.glob(os.path.join(folder, pattern))
+    if len(files) != 1:
+        return elapsed, [f"{len(files)} output files"]
+    if task == "prl":
+        return elapsed, check_prl_session(files[0], orange_first, condition_code)
+    return elapsed, check_memory_session(files[0], condition_code)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run and check batches of headless PRL and memory sessions"
+    )
+    parser.add_argument("subject_code", help="subject whose images are used")
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument(
+        "--tasks", nargs="+", choices=["prl", "memory"], default=["prl", "memory"]
+    )
+    parser.add_argument("--conditions", nargs="+", default=CONDITIONS)
+    parser.add_argument("--responder", default="random")
+    parser.add_argument(
+        "--seed", type=int, default=0, help="seed of the first session"
+    )
+    parser.add_argument(
+        "--output-folder",
+        default="headless_runs",
+        help="each batch writes into its own run_<timestamp> subfolder",
+    )
+    parser.add_argument("--jobs", type=int, default=1, help="sessions run at once")
+    parser.add_argument("--timeout", type=float, default=600, help="per session (s)")
+    args = parser.parse_args()
+
+    # Every batch gets its own folder, so that each session folder holds only
+    # the file written by its run
+    run_folder = os.path.join(
+        args.output_folder, datetime.now().strftime("run_%Y%m%d_%H%M%S")
+    )
+    suffix = 1
+    while os.path.exists(run_folder if suffix == 1 else f"{run_folder}_{suffix}"):
+        suffix += 1
+    if suffix > 1:
+        run_folder = f"{run_folder}_{suffix}"
+    os.makedirs(run_folder)
+
+    # Sessions cycle through the conditions, and orange_first alternates
+    # every full cycle, as in the counterbalancing of the experiment
+    sessions = []
+    for i in range(args.sessions):
+        condition_code = args.conditions[i % len(args.conditions)]
+        orange_first = (i // len(args.conditions)) % 2 == 0
+        name = f"session_{i + 1:03d}_{condition_code}_{'T' if orange_first else 'F'}"
+        for task in args.tasks:
+            folder = os.path.join(run_folder, name, task)
+            seed = args.seed + i
+            sessions.append(
+                (task, args.subject_code, condition_code, orange_first, seed, folder)
+            )
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        results = list(
+            executor.map(
+                lambda session: run_session(session, args.responder, args.timeout),
+                sessions,
+            )
+        )
+
+    failed = 0
+    for session, (elapsed, problems) in zip(sessions, results):
+        status = "ok" if not problems else "FAILED"
+        print(f"{session[5]}: {status} ({elapsed:.1f} s)")
+        for problem in problems[:10]:
+            print(f"  {problem}")
+        failed += bool(problems)
+    print(
+        f"{len(sessions) - failed}/{len(sessions)} sessions ok "
+        f"in {time.time() - start_time:.1f} s"
+    )
+    sys.exit(1 if failed else 0)
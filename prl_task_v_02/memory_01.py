@@ -1,32 +1,32 @@
 import pygame
-import random
-import time
 import os
 import csv
 from datetime import datetime
 import sys
-import gc
+from stimuli import StimulusLayout, prepare_surface
+from timing import set_mode, flip, response_timing
+from responses import wait_for_key, wait, restrict_events
+from bundle import load_image
+from catalog import get_catalog
+from memory_trials import make_records, build_trials
+from rng import Streams, recorded_seed
+import headless
 
 # Definire i colori
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 
-# Inizializzare pygame
-pygame.init()
-pygame.mixer.init()
 
-# Clock per controllare il framerate
-clock = pygame.time.Clock()
-
-
-# Funzione per caricare immagini da un percorso
+# Funzione per caricare immagini da un percorso (dal bundle del soggetto, se
+# esiste, altrimenti dai file PNG). I nomi dei file vengono dal catalogo degli
+# stimoli, senza leggere la cartella.
 def load_images_from_folder(folder):
+    subject_folder, stimulus_folder = os.path.normpath(folder).split(os.sep)[-2:]
     images = []
-    for filename in os.listdir(folder):
-        if filename.endswith(".png"):
-            img = pygame.image.load(os.path.join(folder, filename))
-            if img is not None:
-                images.append((img, filename))
+    for filename in get_catalog().filenames(subject_folder, stimulus_folder):
+        img = load_image(os.path.join(folder, filename))
+        if img is not None:
+            images.append((img, filename))
     return images
 
 
@@ -38,18 +38,37 @@ def memory_task(
     old_white_images,
     new_orange_images,
     new_white_images,
+    streams,
+    vsync=True,
 ):
-    # Impostazioni della finestra
+    # Impostazioni della finestra (vsync come in prl_30.py, --no-vsync per
+    # disattivarlo)
     screen_width, screen_height = (
         pygame.display.Info().current_w,
         pygame.display.Info().current_h,
     )
-    screen = pygame.display.set_mode((screen_width, screen_height), pygame.FULLSCREEN)
+    screen, _ = set_mode((screen_width, screen_height), pygame.FULLSCREEN, vsync=vsync)
     pygame.display.set_caption("Memory Task")
+    restrict_events()  # Solo i tasti e la chiusura svegliano l'attesa
+
+    # Convertire le immagini nel formato del display una sola volta, così che
+    # la presentazione non richieda conversioni pixel per pixel
+    layout = StimulusLayout((screen_width, screen_height))
+    max_size = layout.max_stimulus_size()
+    # Ogni immagine diventa un record con superficie, nome del file e colore
+    def records(images, color):
+        return make_records(
+            [(prepare_surface(img, max_size), name) for img, name in images], color
+        )
 
-    # Caricare tutte le immagini old e new
-    all_old_images = old_orange_images + old_white_images
-    new_images_by_color = {"orange": new_orange_images, "white": new_white_images}
+    old_records = {
+        "orange": records(old_orange_images, "orange"),
+        "white": records(old_white_images, "white"),
+    }
+    new_records = {
+        "orange": records(new_orange_images, "orange"),
+        "white": records(new_white_images, "white"),
+    }
 
     # Funzione per mostrare un punto di fissazione
     def display_fixation():
@@ -69,13 +88,14 @@ def memory_task(
             5,
         )
         pygame.display.flip()
-        pygame.time.wait(100)
+        wait(0.1)
 
-    # Funzione per mostrare schermo nero per un intervallo casuale
-    def display_black_screen():
+    # Funzione per mostrare schermo nero per un intervallo (casuale, estratto
+    # in anticipo)
+    def display_black_screen(duration):
         screen.fill(BLACK)
         pygame.display.flip()
-        pygame.time.wait(random.randint(200, 1000))
+        wait(duration)
 
     # Funzione per visualizzare le immagini e raccogliere la risposta
     def display_images_and_get_response(old_image, new_image, old_image_side):
@@ -87,65 +107,46 @@ def memory_task(
         else:
             image_left, image_right = new_image, old_image
 
-        # Visualizzare le immagini a sinistra e a destra
-        screen.blit(
-            image_left[0],
-            (
-                screen_width // 4 - image_left[0].get_width() // 2,
-                screen_height // 2 - image_left[0].get_height() // 2,
-            ),
-        )
-        screen.blit(
-            image_right[0],
-            (
-                3 * screen_width // 4 - image_right[0].get_width() // 2,
-                screen_height // 2 - image_right[0].get_height() // 2,
-            ),
-        )
-        pygame.display.flip()
+        # Visualizzare le immagini a sinistra e a destra (posizioni precalcolate)
+        layout.blit(screen, image_left.surface, "left")
+        layout.blit(screen, image_right.surface, "right")
+        onset_ns, flip_latency_ns = flip()
 
-        start_time = time.time()
-        key_pressed = None
-
-        # Attendere la risposta dell'utente o un timeout di 3 secondi
-        while time.time() - start_time < 3:
-            for event in pygame.event.get():
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_f:
-                        key_pressed = "left"
-                    elif event.key == pygame.K_j:
-                        key_pressed = "right"
-                    if key_pressed:
-                        reaction_time = time.time() - start_time
-                        return key_pressed, reaction_time
+        # Attendere la risposta dell'utente o un timeout di 3 secondi, senza
+        # tenere occupata la CPU
+        key, response_ns = wait_for_key(
+            [pygame.K_f, pygame.K_j],
+            timeout=3,
+        )
 
         # Se il partecipante non risponde entro 3 secondi
-        reaction_time = 3
-        return None, reaction_time
-
-    # Preparare la sequenza delle prove
-    trials = []
-    for old_image in all_old_images:
-        color = "orange" if old_image in old_orange_images else "white"
-        new_image = random.choice(
-            new_images_by_color[color]
-        )  # Scegliere una nuova immagine dello stesso colore
-        old_image_side = random.choice(
-            ["left", "right"]
-        )  # Determinare se l'immagine old va a sinistra o a destra
-        trials.append((old_image, new_image, old_image_side))
-
-    # Randomizzare l'ordine delle prove
-    random.shuffle(trials)
+        if key is None:
+            reaction_time = 3
+            return None, reaction_time, response_timing(
+                onset_ns, flip_latency_ns, None
+            )
+
+        key_pressed = "left" if key == pygame.K_f else "right"
+        reaction_time = (response_ns - onset_ns) / 1e9
+        return key_pressed, reaction_time, response_timing(
+            onset_ns, flip_latency_ns, response_ns
+        )
+
+    # Preparare la sequenza delle prove, in ordine casuale: ogni immagine old
+    # con una nuova immagine dello stesso colore (estratta senza reinserimento)
+    # e su un lato a caso, e gli intervalli tra le prove (200-1000 ms). Tutto
+    # viene estratto prima della prima prova dai generatori di rng.Streams.
+    trials = build_trials(old_records, new_records, streams["memory_trials"])
+    intervals = [streams["memory_isi"].randint(200, 1000) / 1000 for _ in trials]
 
     # Eseguire il compito di memoria
     trial_results = []
     for trial_num, (old_image, new_image, old_image_side) in enumerate(trials):
-        display_black_screen()
+        display_black_screen(intervals[trial_num])
         display_fixation()
 
         # Visualizzare le immagini e raccogliere la risposta
-        key_pressed, reaction_time = display_images_and_get_response(
+        key_pressed, reaction_time, timing_data = display_images_and_get_response(
             old_image, new_image, old_image_side
         )
 
@@ -158,14 +159,16 @@ def memory_task(
         # Salvare i risultati della prova
         trial_data = {
             "Trial Number": trial_num + 1,
-            "Old Image": old_image[1],
-            "New Image": new_image[1],
+            "Old Image": old_image.filename,
+            "New Image": new_image.filename,
             "Old Image Side": old_image_side,
             "Key Pressed": key_pressed,
             "Correct": correct,
             "Reaction Time": reaction_time,
             "Condition": condition,
             "Timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            **timing_data,
+            "Seed": streams.seed,
         }
         trial_results.append(trial_data)
 
@@ -183,8 +186,13 @@ def save_data(subject_code, condition, trial_results):
         writer.writerows(trial_results)
 
 
-# Eseguire il compito di memoria
-def run_memory_task(subject_code, condition):
+# Eseguire il compito di memoria, con le scelte casuali dipendenti da seed
+# (nuovo se non è dato), che viene salvato con le prove
+def run_memory_task(subject_code, condition, seed=None, vsync=True):
+    # Inizializzare pygame
+    pygame.init()
+    pygame.mixer.init()
+
     # Determinare il percorso delle cartelle delle immagini
     base_path = (
         f"./images/{subject_code}_{'self' if condition in ['A', 'B'] else 'stranger'}"
@@ -208,6 +216,8 @@ def run_memory_task(subject_code, condition):
         old_white_images,
         new_orange_images,
         new_white_images,
+        Streams(seed),
+        vsync,
     )
 
     # Salvare i risultati
@@ -220,10 +230,32 @@ def run_memory_task(subject_code, condition):
 # Esempio di esecuzione
 if __name__ == "__main__":
     if len(sys.argv) < 3:
-        print("Uso: python memory_task.py <subject_code> <condition>")
+        print("Uso: python memory_task.py <subject_code> <condition> [--no-vsync]")
         sys.exit(1)
 
     subject_code = sys.argv[1]
     condition = sys.argv[2]
 
-    run_memory_task(subject_code, condition)
+    # Esecuzione senza schermo, con i tasti premuti da un responder:
+    # --headless [--responder=SPEC] [--seed=N] (vedi headless.py); con
+    # --replay=FILE le scelte casuali sono quelle della sessione in FILE
+    options = dict(
+        arg[2:].split("=", 1) if "=" in arg else (arg[2:], "")
+        for arg in sys.argv[3:]
+        if arg.startswith("--")
+    )
+    if options.get("replay"):
+        try:
+            options["seed"] = str(recorded_seed(options["replay"]))
+        except (OSError, ValueError) as e:
+            print(f"Impossibile ripetere {options['replay']}: {e}")
+            sys.exit(1)
+    if "headless" in options:
+        headless.start(options.get("responder") or "random", options.get("seed"))
+
+    run_memory_task(
+        subject_code,
+        condition,
+        seed=options.get("seed"),
+        vsync="no-vsync" not in options,
+    )
@@ -1,27 +1,22 @@
 import pygame
-import random
-import time
 import os
-import csv
 from datetime import datetime
 import sys
-import gc
+from stimuli import StimulusLayout, prepare_surface, prefetched_image
+from timing import set_mode, flip, response_timing
+from responses import wait_for_key, wait, restrict_events
+from bundle import load_image
+from catalog import get_catalog
+from trial_logger import TrialLogger
+from rng import Streams, recorded_seed
+from memory_trials import make_records, build_trials
+import headless
+import audio
 
 # Definire i colori
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 
-# Inizializzare pygame
-pygame.init()
-pygame.mixer.init()
-
-# Clock per controllare il framerate
-clock = pygame.time.Clock()
-
-# Caricare i suoni
-nice_sound = pygame.mixer.Sound("beeps/pleasant.wav")
-ugly_sound = pygame.mixer.Sound("beeps/unpleasant.wav")
-
 # Definire la mappatura delle condizioni con gli intervalli di immagini
 image_ranges = {
     "A": (1, 50),  # Self/surprise: immagini 1-50
@@ -32,34 +27,47 @@ image_ranges = {
 
 
 # Funzione per caricare immagini da un percorso, selezionando solo l'intervallo specificato
+# (dal bundle del soggetto, se esiste, altrimenti dai file PNG). Le immagini
+# presenti nell'intervallo vengono dal catalogo degli stimoli, senza
+# controllare l'esistenza di ogni file; quelle già preparate in anticipo da
+# run_session.py non vengono decodificate di nuovo.
 def load_images_from_folder(folder, start, end):
+    subject_folder, stimulus_folder = os.path.normpath(folder).split(os.sep)[-2:]
+    catalog = get_catalog()
     images = []
-    for i in range(start, end + 1):
-        filename = f"{folder.split('/')[-1]}_img_{i:03d}.png"
-        img_path = os.path.join(folder, filename)
-        if os.path.exists(img_path):
-            img = pygame.image.load(img_path)
-            images.append((img, filename))
+    for filename in catalog.filenames(subject_folder, stimulus_folder, start, end):
+        path = os.path.join(folder, filename)
+        images.append((prefetched_image(path) or load_image(path), filename))
     return images
 
 
-# Funzione per chiudere il programma in modo sicuro e salvare i dati prima di uscire
-def safe_exit(subject_code, condition, trial_results, filename):
+# Colonne del file CSV dei risultati
+FIELDNAMES = [
+    "Trial Number",
+    "Old Image",
+    "New Image",
+    "Old Image Side",
+    "Key Pressed",
+    "Correct",
+    "Reaction Time",
+    "Condition",
+    "Timestamp",
+    "Stimulus Onset (ns)",
+    "Response Time (ns)",
+    "Flip Latency (ms)",
+    "Seed",
+]
+
+
+# Funzione per chiudere il programma in modo sicuro, dopo aver scritto su
+# disco tutte le prove già registrate
+def safe_exit(trial_logger):
     print("Uscita dal programma. Salvataggio dei dati...")
-    save_data(subject_code, condition, trial_results, filename)
+    trial_logger.close()
     pygame.quit()
     sys.exit(0)
 
 
-# Funzione per salvare i dati in un file CSV
-def save_data(subject_code, condition, trial_results, filename):
-    with open(filename, mode="a", newline="") as file:
-        writer = csv.DictWriter(file, fieldnames=trial_results[0].keys())
-        if os.stat(filename).st_size == 0:
-            writer.writeheader()  # Scrive l'header solo se il file è vuoto
-        writer.writerows(trial_results)
-
-
 # Funzione per creare il compito di memoria
 def memory_task(
     subject_code,
@@ -68,19 +76,51 @@ def memory_task(
     old_white_images,
     new_orange_images,
     new_white_images,
-    filename,
+    trial_logger,
+    streams,
+    vsync=True,
 ):
-    # Impostazioni della finestra
-    screen_width, screen_height = (
-        pygame.display.Info().current_w,
-        pygame.display.Info().current_h,
-    )
-    screen = pygame.display.set_mode((screen_width, screen_height), pygame.FULLSCREEN)
+    # Impostazioni della finestra (riusata se è già aperta, come quando
+    # run_session.py esegue il compito dopo il PRL; vsync come in prl_30.py,
+    # --no-vsync per disattivarlo)
+    screen = pygame.display.get_surface()
+    if screen is None:
+        screen_width, screen_height = (
+            pygame.display.Info().current_w,
+            pygame.display.Info().current_h,
+        )
+        screen, _ = set_mode(
+            (screen_width, screen_height), pygame.FULLSCREEN, vsync=vsync
+        )
+    screen_width, screen_height = screen.get_size()
     pygame.display.set_caption("Memory Task")
+    restrict_events()  # Solo i tasti e la chiusura svegliano l'attesa
+
+    # Caricare i suoni una sola volta, ciascuno sul proprio canale riservato
+    feedback_sounds = audio.get_feedback_sounds()
+
+    # Uscita con ESC e salvataggio
+    def on_escape():
+        safe_exit(trial_logger)
+
+    # Convertire le immagini nel formato del display una sola volta, così che
+    # la presentazione non richieda conversioni pixel per pixel
+    layout = StimulusLayout((screen_width, screen_height))
+    max_size = layout.max_stimulus_size()
+    # Ogni immagine diventa un record con superficie, nome del file e colore
+    def records(images, color):
+        return make_records(
+            [(prepare_surface(img, max_size), name) for img, name in images], color
+        )
 
-    # Caricare tutte le immagini old e new
-    all_old_images = old_orange_images + old_white_images
-    new_images_by_color = {"orange": new_orange_images, "white": new_white_images}
+    old_records = {
+        "orange": records(old_orange_images, "orange"),
+        "white": records(old_white_images, "white"),
+    }
+    new_records = {
+        "orange": records(new_orange_images, "orange"),
+        "white": records(new_white_images, "white"),
+    }
 
     # Funzione per mostrare un punto di fissazione
     def display_fixation():
@@ -100,13 +140,14 @@ def memory_task(
             5,
         )
         pygame.display.flip()
-        pygame.time.wait(100)
+        wait(0.1, on_escape=on_escape)
 
-    # Funzione per mostrare schermo nero per un intervallo casuale
-    def display_black_screen():
+    # Funzione per mostrare schermo nero per un intervallo (casuale, estratto
+    # in anticipo)
+    def display_black_screen(duration):
         screen.fill(BLACK)
         pygame.display.flip()
-        pygame.time.wait(random.randint(200, 1000))
+        wait(duration, on_escape=on_escape)
 
     # Funzione per visualizzare le immagini e raccogliere la risposta
     def display_images_and_get_response(old_image, new_image, old_image_side):
@@ -118,106 +159,94 @@ def memory_task(
         else:
             image_left, image_right = new_image, old_image
 
-        # Visualizzare le immagini a sinistra e a destra
-        screen.blit(
-            image_left[0],
-            (
-                screen_width // 4 - image_left[0].get_width() // 2,
-                screen_height // 2 - image_left[0].get_height() // 2,
-            ),
+        # Visualizzare le immagini a sinistra e a destra (posizioni precalcolate)
+        layout.blit(screen, image_left.surface, "left")
+        layout.blit(screen, image_right.surface, "right")
+        onset_ns, flip_latency_ns = flip()
+
+        # Attendere la risposta dell'utente o un timeout di 3 secondi, senza
+        # tenere occupata la CPU
+        key, response_ns = wait_for_key(
+            [pygame.K_f, pygame.K_j],
+            timeout=3,
+            on_escape=on_escape,
         )
-        screen.blit(
-            image_right[0],
-            (
-                3 * screen_width // 4 - image_right[0].get_width() // 2,
-                screen_height // 2 - image_right[0].get_height() // 2,
-            ),
-        )
-        pygame.display.flip()
-
-        start_time = time.time()
-        key_pressed = None
-
-        # Attendere la risposta dell'utente o un timeout di 3 secondi
-        while time.time() - start_time < 3:
-            for event in pygame.event.get():
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_ESCAPE:
-                        safe_exit(
-                            subject_code, condition, trial_results, filename
-                        )  # Uscita con ESC e salvataggio dei dati
-                    elif event.key == pygame.K_f:
-                        key_pressed = "left"
-                    elif event.key == pygame.K_j:
-                        key_pressed = "right"
-                    if key_pressed:
-                        reaction_time = time.time() - start_time
-                        return key_pressed, reaction_time
 
         # Se il partecipante non risponde entro 3 secondi
-        reaction_time = 3
-        return None, reaction_time
-
-    # Preparare la sequenza delle prove
-    trials = []
-    for old_image in all_old_images:
-        color = "orange" if old_image in old_orange_images else "white"
-        new_image = random.choice(
-            new_images_by_color[color]
-        )  # Scegliere una nuova immagine dello stesso colore
-        old_image_side = random.choice(
-            ["left", "right"]
-        )  # Determinare se l'immagine old va a sinistra o a destra
-        trials.append((old_image, new_image, old_image_side))
-
-    # Randomizzare l'ordine delle prove
-    random.shuffle(trials)
+        if key is None:
+            reaction_time = 3
+            return None, reaction_time, response_timing(
+                onset_ns, flip_latency_ns, None
+            )
+
+        key_pressed = "left" if key == pygame.K_f else "right"
+        reaction_time = (response_ns - onset_ns) / 1e9
+        return key_pressed, reaction_time, response_timing(
+            onset_ns, flip_latency_ns, response_ns
+        )
+
+    # Preparare la sequenza delle prove, in ordine casuale: ogni immagine old
+    # con una nuova immagine dello stesso colore (estratta senza reinserimento)
+    # e su un lato a caso, e gli intervalli tra le prove (200-1000 ms). Tutto
+    # viene estratto prima della prima prova dai generatori di rng.Streams.
+    trials = build_trials(old_records, new_records, streams["memory_trials"])
+    intervals = [streams["memory_isi"].randint(200, 1000) / 1000 for _ in trials]
 
     # Eseguire il compito di memoria
-    trial_results = []
     for trial_num, (old_image, new_image, old_image_side) in enumerate(trials):
-        display_black_screen()
+        display_black_screen(intervals[trial_num])
         display_fixation()
 
         # Visualizzare le immagini e raccogliere la risposta
-        key_pressed, reaction_time = display_images_and_get_response(
+        key_pressed, reaction_time, timing_data = display_images_and_get_response(
             old_image, new_image, old_image_side
         )
 
         # Determinare se la risposta è corretta
         if key_pressed == old_image_side:
             correct = True
-            nice_sound.play()  # Suono di feedback corretto
+            feedback_sounds.play("pleasant")  # Suono di feedback corretto
         else:
             correct = False
-            ugly_sound.play()  # Suono di feedback sbagliato
+            feedback_sounds.play("unpleasant")  # Suono di feedback sbagliato
 
         # Salvare i risultati della prova
         trial_data = {
             "Trial Number": trial_num + 1,
-            "Old Image": old_image[1],
-            "New Image": new_image[1],
+            "Old Image": old_image.filename,
+            "New Image": new_image.filename,
             "Old Image Side": old_image_side,
             "Key Pressed": key_pressed,
             "Correct": correct,
             "Reaction Time": reaction_time,
             "Condition": condition,
             "Timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            **timing_data,
         }
-        trial_results.append(trial_data)
-
-        pygame.time.wait(500)  # Attendere mezzo secondo dopo la risposta
+        # Il file viene scritto da un thread in background, senza bloccare
+        # la presentazione delle prove
+        trial_logger.log(trial_data)
 
-        # Salvare ogni 5 prove
-        if (trial_num + 1) % 5 == 0:
-            save_data(subject_code, condition, trial_results, filename)
-            trial_results = []  # Ripristina i risultati memorizzati temporaneamente
+        wait(0.5, on_escape=on_escape)  # Attendere mezzo secondo dopo la risposta
 
-    return trial_results
 
+# Eseguire il compito di memoria, salvando i risultati in output_folder. Con
+# quit_pygame=False la finestra e il mixer restano aperti per il compito
+# successivo (run_session.py). Le scelte casuali dipendono da seed (nuovo se
+# non è dato), che viene salvato con le prove.
+def run_memory_task(
+    subject_code,
+    condition,
+    output_folder="",
+    quit_pygame=True,
+    seed=None,
+    vsync=True,
+):
+    # Inizializzare pygame e il mixer (con il buffer ridotto di audio.py)
+    audio.pre_init()
+    pygame.init()
+    pygame.mixer.init()
 
-# Eseguire il compito di memoria
-def run_memory_task(subject_code, condition):
     # Determinare l'intervallo di immagini da usare in base alla condizione
     start, end = image_ranges[condition]
 
@@ -238,34 +267,69 @@ def run_memory_task(subject_code, condition):
 
     # Creare un file per salvare i risultati
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"memory_task_{subject_code}_{condition}_{timestamp}.csv"
+    filename = os.path.join(
+        output_folder, f"memory_task_{subject_code}_{condition}_{timestamp}.csv"
+    )
+    streams = Streams(seed)
+    trial_logger = TrialLogger(filename, FIELDNAMES, defaults={"Seed": streams.seed})
 
     # Eseguire il compito di memoria
-    trial_results = memory_task(
+    memory_task(
         subject_code,
         condition,
         old_orange_images,
         old_white_images,
         new_orange_images,
         new_white_images,
-        filename,
+        trial_logger,
+        streams,
+        vsync,
     )
 
-    # Salvare i risultati finali
-    if trial_results:
-        save_data(subject_code, condition, trial_results, filename)
+    # Scrivere su disco le ultime prove
+    trial_logger.close()
 
     # Chiudere pygame
-    pygame.quit()
+    if quit_pygame:
+        pygame.quit()
 
 
 # Esempio di esecuzione
 if __name__ == "__main__":
     if len(sys.argv) < 3:
-        print("Uso: python memory_task.py <subject_code> <condition>")
+        print("Uso: python memory_task.py <subject_code> <condition> [opzioni]")
+        print("Opzioni (come per prl_30.py):")
+        print("  --headless --responder=SPEC --seed=N --output-folder=DIR --no-vsync")
+        print("  --replay=FILE (stesse scelte casuali della sessione in FILE)")
         sys.exit(1)
 
     subject_code = sys.argv[1]
     condition = sys.argv[2]
 
-    run_memory_task(subject_code, condition)
+    # Opzioni dopo gli argomenti posizionali, es. --seed=3
+    options = dict(
+        arg[2:].split("=", 1) if "=" in arg else (arg[2:], "")
+        for arg in sys.argv[3:]
+        if arg.startswith("--")
+    )
+    if options.get("replay"):
+        # Ripetere le scelte casuali di una sessione salvata
+        try:
+            options["seed"] = str(recorded_seed(options["replay"]))
+        except (OSError, ValueError) as e:
+            print(f"Impossibile ripetere {options['replay']}: {e}")
+            sys.exit(1)
+    if "headless" in options:
+        # Nessuno schermo né audio, i tasti sono premuti da un responder
+        headless.start(options.get("responder") or "random", options.get("seed"))
+    output_folder = options.get("output-folder", "")
+    if output_folder:
+        os.makedirs(output_folder, exist_ok=True)
+
+    run_memory_task(
+        subject_code,
+        condition,
+        output_folder,
+        seed=options.get("seed"),
+        vsync="no-vsync" not in options,
+    )
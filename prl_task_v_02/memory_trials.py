@@ -0,0 +1,58 @@
+import random
+import re
+
+COLORS = ["orange", "white"]
+
+IMAGE_NUMBER = re.compile(r"(\d+)\.png$")
+
+
+# One image of the memory task: the surface to show, its file name, its
+# colour and its number in the file name (None if it has none)
+class StimulusRecord:
+    __slots__ = ("surface", "filename", "color", "index")
+
+    def __init__(self, surface, filename, color, index=None):
+        self.surface = surface
+        self.filename = filename
+        self.color = color
+        self.index = index
+
+    def __repr__(self):
+        return f"StimulusRecord({self.filename!r}, {self.color!r})"
+
+
+# Records of (surface, filename) pairs of one colour
+def make_records(images, color):
+    records = []
+    for surface, filename in images:
+        match = IMAGE_NUMBER.search(filename)
+        index = int(match.group(1)) if match else None
+        records.append(StimulusRecord(surface, filename, color, index))
+    return records
+
+
+# n foils drawn without replacement; a foil is only reused once all of them
+# have been drawn (when there are fewer new images than old ones)
+def sample_foils(new_records, n, rng=random):
+    if n and not new_records:
+        raise ValueError("No new images to pair with the old ones")
+    foils = []
+    while len(foils) < n:
+        foils += rng.sample(new_records, min(len(new_records), n - len(foils)))
+    return foils
+
+
+# The trials of a recognition session, in random order: every old image once,
+# paired with a new image of the same colour and shown on a random side.
+# old_records and new_records map each colour to its records. Linear in the
+# number of images.
+def build_trials(old_records, new_records, rng=random):
+    trials = []
+    for color in COLORS:
+        old = old_records.get(color, [])
+        foils = sample_foils(new_records.get(color, []), len(old), rng)
+        for old_image, new_image in zip(old, foils):
+            old_image_side = rng.choice(["left", "right"])
+            trials.append((old_image, new_image, old_image_side))
+    rng.shuffle(trials)
+    return trials
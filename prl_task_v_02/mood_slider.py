@@ -0,0 +1,95 @@
+import pygame
+import pygame_gui
+from responses import allow_gui_events, block_gui_events, is_headless, post_response
+
+THEME_FILE = "data/themes/theme.json"
+INITIAL_VALUE = 50
+VALUE_RANGE = (0, 100)
+
+# Keys that move the slider and by how much
+STEPS = {pygame.K_d: -10, pygame.K_k: 10, pygame.K_f: -1, pygame.K_j: 1}
+
+
+# The mood slider of the PRL task, built once per session: the GUI manager
+# (which parses the theme), the slider, the font, the rendered labels and the
+# clock are all created here, and each rating only resets the value. The
+# screen is redrawn only when something may have changed: an event, or a
+# new slider value.
+class MoodSlider:
+    def __init__(self, screen, on_escape=None, theme_file=THEME_FILE):
+        self.screen = screen
+        self.on_escape = on_escape
+        width, height = screen.get_size()
+        self.manager = pygame_gui.UIManager((width, height), theme_file)
+        self.rect = pygame.Rect((width / 2 - 450, height / 2 - 25), (900, 50))
+        self.slider = pygame_gui.elements.UIHorizontalSlider(
+            self.rect, INITIAL_VALUE, VALUE_RANGE, self.manager
+        )
+        self.clock = pygame.time.Clock()
+
+        font = pygame.font.SysFont(None, 24)
+        self.labels = []
+        for text, x in [
+            ("Molto male", self.rect.left - 60),
+            ("Molto bene", self.rect.right + 60),
+        ]:
+            surface = font.render(text, True, (0, 0, 0))
+            rect = surface.get_rect(center=(x, self.rect.centery))
+            self.labels.append((surface, rect))
+
+    def draw(self):
+        self.screen.fill((255, 255, 255))
+        for surface, rect in self.labels:
+            self.screen.blit(surface, rect)
+        self.manager.draw_ui(self.screen)
+        pygame.display.flip()
+
+    # Show the slider until the participant moves it and confirms with the
+    # space bar; returns the rating
+    def run(self):
+        self.slider.set_current_value(INITIAL_VALUE)
+        pygame.mouse.set_visible(True)
+        allow_gui_events()  # The slider needs mouse events
+
+        # Headless runs: the responder moves the slider once and confirms
+        if is_headless():
+            post_response(list(STEPS))
+            post_response([pygame.K_SPACE])
+
+        self.draw()
+        changed = False
+        value = INITIAL_VALUE
+        dirty = False
+        self.clock.tick()  # Do not count the time since the last rating
+        running = True
+        while running:
+            time_delta = self.clock.tick(60) / 1000.0
+            for event in pygame.event.get():
+                dirty = True
+                if event.type == pygame.QUIT:
+                    running = False
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_ESCAPE and self.on_escape is not None:
+                        self.on_escape()
+                    value = self.slider.get_current_value() + STEPS.get(event.key, 0)
+                    value = max(VALUE_RANGE[0], min(VALUE_RANGE[1], value))
+                    self.slider.set_current_value(value)
+                    changed = changed or value != INITIAL_VALUE
+                    if event.key == pygame.K_SPACE and changed:
+                        running = False
+                self.manager.process_events(event)
+
+            # The value can also change by dragging or holding an arrow button
+            self.manager.update(time_delta)
+            current = self.slider.get_current_value()
+            if current != value:
+                value = current
+                dirty = True
+
+            if dirty and running:
+                self.draw()
+                dirty = False
+
+        pygame.mouse.set_visible(False)
+        block_gui_events()
+        return self.slider.get_current_value()
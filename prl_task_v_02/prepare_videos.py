@@ -0,0 +1,139 @@
+import argparse
+import json
+import os
+import sys
+import time
+import cv2
+
+# Folder with the pre-scaled videos, one subfolder per display size
+PRESCALED_FOLDER = "prescaled"
+VIDEO_FOLDERS = ["surprise", "nosurprise"]
+MANIFEST_NAME = "manifest.json"
+
+
+def size_folder(size):
+    return os.path.join(PRESCALED_FOLDER, f"{size[0]}x{size[1]}")
+
+
+# Measure the display the same way prl_30.py does before opening the window
+def measure_display():
+    import pygame
+
+    pygame.display.init()
+    info = pygame.display.Info()
+    size = (info.current_w, info.current_h)
+    pygame.display.quit()
+    return size
+
+
+# Re-encode a video at the target size as Motion JPEG: every frame is an
+# intra frame, so decoding needs no reference frames and no scaling
+def transcode(source_path, target_path, size):
+    cap = cv2.VideoCapture(source_path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video {source_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    writer = cv2.VideoWriter(
+        target_path, cv2.VideoWriter_fourcc(*"MJPG"), fps, size
+    )
+    if not writer.isOpened():
+        cap.release()
+        raise IOError(f"Could not write video {target_path}")
+
+    n_frames = 0
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if frame.shape[1] != size[0] or frame.shape[0] != size[1]:
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            writer.write(frame)
+            n_frames += 1
+    finally:
+        cap.release()
+        writer.release()
+    return n_frames, fps
+
+
+def prepare_videos(size, force=False):
+    output_folder = size_folder(size)
+    manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+    manifest = load_manifest(size) or {"size": list(size), "videos": {}}
+
+    for folder in VIDEO_FOLDERS:
+        if not os.path.isdir(folder):
+            continue
+        os.makedirs(os.path.join(output_folder, folder), exist_ok=True)
+        for filename in sorted(os.listdir(folder)):
+            if not filename.endswith(".mov"):
+                continue
+            source_path = f"{folder}/{filename}"
+            target_file = f"{folder}/{os.path.splitext(filename)[0]}.avi"
+            entry = manifest["videos"].get(source_path)
+            if (
+                not force
+                and entry is not None
+                and entry["source_mtime"] == os.path.getmtime(source_path)
+                and os.path.exists(os.path.join(output_folder, target_file))
+            ):
+                print(f"{source_path}: up to date")
+                continue
+
+            start_time = time.time()
+            n_frames, fps = transcode(
+                source_path, os.path.join(output_folder, target_file), size
+            )
+            manifest["videos"][source_path] = {
+                "file": target_file,
+                "frames": n_frames,
+                "fps": fps,
+                "duration": n_frames / fps if fps else None,
+                "source_mtime": os.path.getmtime(source_path),
+            }
+            print(
+                f"{source_path}: {n_frames} frames in {time.time() - start_time:.1f} s"
+            )
+
+            # Write the manifest after every video so an interrupted run keeps
+            # the work already done
+            with open(manifest_path, "w") as manifest_file:
+                json.dump(manifest, manifest_file, indent=2)
+
+    return manifest
+
+
+def load_manifest(size):
+    manifest_path = os.path.join(size_folder(size), MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Pre-scale the surprise/nosurprise videos to the display size"
+    )
+    parser.add_argument(
+        "--size",
+        type=parse_size,
+        help="target size as WIDTHxHEIGHT (default: the current display size)",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="transcode videos that are up to date"
+    )
+    args = parser.parse_args()
+
+    size = args.size or measure_display()
+    print(f"Preparing videos for {size[0]}x{size[1]} in {size_folder(size)}")
+    try:
+        prepare_videos(size, force=args.force)
+    except IOError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
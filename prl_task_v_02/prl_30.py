@@ -1,30 +1,52 @@
 import pygame
-import random
-import cv2
-import csv
-import time
 import os
 import gc
-import pygame_gui
 import sys
-from itertools import cycle
 from datetime import datetime
+from video_player import play_video_file
+from mood_slider import MoodSlider
+from trial_logger import TrialLogger
+import headless
+import audio
+from video_cache import VideoCache, DEFAULT_BUDGET_MB
+from stimuli import StimulusLoader, StimulusLayout, load_surface
+from bundle import open_bundle, bundle_path
+from catalog import get_catalog
+from rng import Streams, recorded_seed
+from timing import (
+    set_mode,
+    flip,
+    response_timing,
+    clock_resolution_ns,
+    vsync_active,
+)
+from responses import (
+    wait_for_key,
+    wait,
+    restrict_events,
+    is_headless,
+)
+from prl_schedule import (
+    N_EPOCHS,
+    TRIALS_PER_EPOCH,
+    IMAGE_RANGES,
+    VIDEO_TYPES,
+    FIELDNAMES,
+    reward_probabilities as epoch_reward_probabilities,
+    most_rewarded_stimulus as epoch_most_rewarded_stimulus,
+    is_mood_trial,
+    video_files,
+    reward_probability,
+    trial_table,
+)
 
-# Check if the correct number of command-line arguments is provided
-if len(sys.argv) < 4:
-    print("Usage: python3 prl.py <subject_code> <condition> <orange_first>")
-    print("<condition> can be 'A', 'B', 'C', or 'D'")
-    print(
-        "<orange_first> can be 'T' for orange rewarded first or 'F' for white rewarded first"
-    )
-    sys.exit(1)  # Exit the script if the necessary arguments are not provided
-
-# Parse command line arguments
-subject_code = sys.argv[1]  # e.g., "subject_1"
-condition_code = sys.argv[2]  # "A", "B", "C", "D"
-orange_first_arg = sys.argv[3]  # "T" for orange first, "F" for white first
+# Define colors
+WHITE = (255, 255, 255)
+BLACK = (0, 0, 0)
+GREEN = (0, 255, 0)
+RED = (255, 0, 0)
 
-# Ensure valid condition
+# Conditions
 condition_map = {
     "A": "self_surprise",
     "B": "self_no_surprise",
@@ -32,151 +54,96 @@ condition_map = {
     "D": "stranger_no_surprise",
 }
 
-if condition_code not in condition_map:
-    print("Invalid condition code")
-    sys.exit(1)
-
-# Set the variable orange_first based on the input "T" or "F"
-orange_first = True if orange_first_arg == "T" else False
-
 # Define the mapping of conditions to image ranges and video type
-image_ranges = {
-    "A": (1, 50),  # Self/surprise: images 1-50
-    "B": (51, 100),  # Self/no-surprise: images 51-100
-    "C": (1, 50),  # Stranger/surprise: images 1-50
-    "D": (51, 100),  # Stranger/no-surprise: images 51-100
-}
-
-video_type_map = {
-    "A": "surprise",
-    "B": "nosurprise",
-    "C": "surprise",
-    "D": "nosurprise",
-}
-
-# Define colors
-WHITE = (255, 255, 255)
-BLACK = (0, 0, 0)
-GREEN = (0, 255, 0)
-RED = (255, 0, 0)
-
-
-import csv
-from datetime import datetime
+image_ranges = IMAGE_RANGES
+video_type_map = VIDEO_TYPES
 
+# Structure of the main experiment loop
+n_epochs = N_EPOCHS
+trials_per_epoch = TRIALS_PER_EPOCH
+response_keys = {pygame.K_f: "Left", pygame.K_j: "Right", pygame.K_ESCAPE: "Exit"}
 
-def save_data(trial_data, filename="experiment_data.csv", mode="a"):
-    fieldnames = [
-        "Subject Code",
-        "Condition",
-        "Trial Number",
-        "Epoch",
-        "Chosen Color",
-        "Orange First",
-        "Stimulus Position",
-        "Key Pressed",
-        "Reaction Time",
-        "Feedback Received",
-        "Chosen Image",
-        "Most Rewarded Stimulus in Epoch",
-        "Image Left",
-        "Image Right",
-        "Mood Slider Value",
-        "Video Type",
-        "Video File Name",
-    ]
-
-    with open(filename, mode, newline="") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        if csvfile.tell() == 0:
-            writer.writeheader()  # Write the header only if the file is new
-        for data in trial_data:
-            data["Subject Code"] = subject_code
-            data["Condition"] = condition_code  # Include condition code directly
-            data["Video Type"] = video_type_map[condition_code]  # Include video type
-        writer.writerows(trial_data)  # Write the trial data
-
+# Set up once per process by setup_display() and run_experiment(), and kept
+# across the conditions when run_session.py runs them one after the other
+screen = None
+video_cache = None
 
-# Use the provided subject_code and condition when generating the filename for experiment data
-timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-experiment_filename = f"experiment_data_{subject_code}_{condition_code}_{timestamp}.csv"
 
-save_data([], filename=experiment_filename, mode="w")  # Create the file with the header
+def usage():
+    print("Usage: python3 prl.py <subject_code> <condition> <orange_first> [options]")
+    print("<condition> can be 'A', 'B', 'C', or 'D'")
+    print(
+        "<orange_first> can be 'T' for orange rewarded first or 'F' for white rewarded first"
+    )
+    print("Options:")
+    print("  --video-cache[=MB]  decode each video once and keep it in memory")
+    print("  --video-preload     decode all videos of the condition at startup")
+    print("  --lazy-images       decode each epoch's images just ahead of time")
+    print("  --no-vsync          do not synchronise flips to the vertical blank")
+    print("  --headless          no display or sound, a responder presses the keys")
+    print("  --responder=SPEC    headless responder: random (default) or script:<keys>")
+    print("  --seed=N            seed the random choices of the task")
+    print("  --replay=FILE       same random choices as the session saved in FILE")
+    print("  --output-folder=DIR write the data file in DIR")
+    sys.exit(1)  # Exit the script if the necessary arguments are not provided
 
 
-# Define a function to play sounds
-def play_sound(sound_file):
-    sound = pygame.mixer.Sound(sound_file)
-    sound.play()
+# Parse command line arguments
+def parse_args(argv):
+    # Check if the correct number of command-line arguments is provided
+    if len(argv) < 4:
+        usage()
+
+    subject_code = argv[1]  # e.g., "subject_1"
+    condition_code = argv[2]  # "A", "B", "C", "D"
+    orange_first_arg = argv[3]  # "T" for orange first, "F" for white first
+
+    # Optional flags after the positional arguments, e.g. --video-cache=2048
+    options = dict(
+        arg[2:].split("=", 1) if "=" in arg else (arg[2:], "")
+        for arg in argv[4:]
+        if arg.startswith("--")
+    )
 
+    # Ensure valid condition
+    if condition_code not in condition_map:
+        print("Invalid condition code")
+        sys.exit(1)
 
-def determine_reward(epoch, stimulus_color):
-    # Extract the reward probabilities for the current epoch
-    probs = reward_probabilities[epoch]
+    # Set the variable orange_first based on the input "T" or "F"
+    orange_first = True if orange_first_arg == "T" else False
+    return subject_code, condition_code, orange_first, options
 
-    # Determine the probability of reward based on the chosen color
-    reward_prob = probs[0] if stimulus_color == "Orange" else probs[1]
 
-    # Generate a random number and compare it to the reward probability
-    return random.random() < reward_prob
+# Rewarded if the trial's reward draw is below the chosen colour's probability
+def determine_reward(epoch, stimulus_color, reward_draw):
+    return reward_draw < reward_probability(reward_probabilities, epoch, stimulus_color)
 
 
-# Function to display images and get response
+# Function to display images and get response, with the orange image on the
+# given side
 def display_images_and_get_response(
-    orange_img, white_img, epoch, orange_file, white_file
+    orange_img, white_img, orange_file, white_file, orange_position
 ):
     screen.fill(WHITE)
-    positions = ["Left", "Right"]
-    random.shuffle(positions)
 
-    if positions[0] == "Left":
+    if orange_position == "Left":
         image_left_file = orange_file
         image_right_file = white_file
-        screen.blit(
-            orange_img,
-            (
-                screen_width / 4 - orange_img.get_width() / 2,
-                screen_height / 2 - orange_img.get_height() / 2,
-            ),
-        )
-        screen.blit(
-            white_img,
-            (
-                3 * screen_width / 4 - white_img.get_width() / 2,
-                screen_height / 2 - white_img.get_height() / 2,
-            ),
-        )
+        layout.blit(screen, orange_img, "left")
+        layout.blit(screen, white_img, "right")
     else:
         image_left_file = white_file
         image_right_file = orange_file
-        screen.blit(
-            white_img,
-            (
-                screen_width / 4 - white_img.get_width() / 2,
-                screen_height / 2 - white_img.get_height() / 2,
-            ),
-        )
-        screen.blit(
-            orange_img,
-            (
-                3 * screen_width / 4 - orange_img.get_width() / 2,
-                screen_height / 2 - orange_img.get_height() / 2,
-            ),
-        )
+        layout.blit(screen, white_img, "left")
+        layout.blit(screen, orange_img, "right")
 
-    pygame.display.flip()
+    onset_ns, flip_latency_ns = flip()
 
-    start_time = time.time()
-    key_pressed = None
-    while key_pressed is None:
-        for event in pygame.event.get():
-            if event.type == pygame.KEYDOWN:
-                if event.key in response_keys:
-                    key_pressed = response_keys[event.key]
-                    reaction_time = time.time() - start_time
-                    break
-                elif event.key == pygame.K_ESCAPE:
-                    safe_exit()
+    # Sleep until a response key is pressed (Escape ends the experiment)
+    key, response_ns = wait_for_key([pygame.K_f, pygame.K_j], on_escape=safe_exit)
+    key_pressed = response_keys[key]
+    reaction_time = (response_ns - onset_ns) / 1e9
 
     # Determine the chosen image based on the key pressed
     chosen_image_file = (
@@ -186,12 +153,13 @@ def display_images_and_get_response(
     )
 
     return (
-        positions[0],
+        orange_position,
         key_pressed,
         reaction_time,
         chosen_image_file,
         image_left_file,
         image_right_file,
+        response_timing(onset_ns, flip_latency_ns, response_ns),
     )
 
 
@@ -205,10 +173,7 @@ def check_for_exit():
             pygame.mouse.set_visible(True)
 
 
-def display_fixation():
-    duration = random.uniform(
-        0.25, 1.25
-    )  # Random duration between 0.25 and 1.25 seconds
+def display_fixation(duration):
     screen.fill(WHITE)
     pygame.draw.line(
         screen,
@@ -225,35 +190,52 @@ def display_fixation():
         5,
     )
     pygame.display.flip()
-    start_time = time.time()
-    while time.time() - start_time < duration:
-        check_for_exit()
+    wait(duration, on_escape=safe_exit)
 
 
-# Load images for the PRL task based on subject and condition
-def load_images(subject_code, condition_code):
+# Load images for the PRL task based on subject and condition. Images are
+# decoded on a thread pool, converted to the display format and scaled down
+# if they do not fit in half of the screen. In lazy mode
+# the image lists are loaders that decode images on demand, and only the
+# first epoch is decoded ahead of time.
+def load_images(subject_code, condition_code, lazy=False):
     start, end = image_ranges[condition_code]
     folder_type = "self" if condition_code in ["A", "B"] else "stranger"
     subject_folder = f"{subject_code}_{folder_type}"
     orange_folder = os.path.join("images", subject_folder, "old_orange")
     white_folder = os.path.join("images", subject_folder, "old_white")
 
+    if open_bundle(subject_code) is not None:
+        print(f"Using the stimulus bundle {bundle_path(subject_code)}")
+
     try:
-        # Load all images at once, but don't create lists yet
-        orange_images = []
-        white_images = []
-        orange_image_files = []
-        white_image_files = []
-
-        # Load exactly 50 images (from start to end)
-        for i in range(start, end + 1):
-            orange_path = os.path.join(orange_folder, f"old_orange_img_{i:03d}.png")
-            white_path = os.path.join(white_folder, f"old_white_img_{i:03d}.png")
-
-            orange_images.append(pygame.image.load(orange_path))
-            white_images.append(pygame.image.load(white_path))
-            orange_image_files.append(f"old_orange_img_{i:03d}.png")
-            white_image_files.append(f"old_white_img_{i:03d}.png")
+        # Exactly 50 images (from start to end), looked up in the stimulus
+        # catalog instead of on disk
+        catalog = get_catalog()
+        orange_image_files = [
+            catalog.filename(subject_folder, "old_orange", i)
+            for i in range(start, end + 1)
+        ]
+        white_image_files = [
+            catalog.filename(subject_folder, "old_white", i)
+            for i in range(start, end + 1)
+        ]
+        orange_paths = [os.path.join(orange_folder, f) for f in orange_image_files]
+        white_paths = [os.path.join(white_folder, f) for f in white_image_files]
+
+        max_size = layout.max_stimulus_size()
+        if lazy:
+            orange_images = StimulusLoader(orange_paths, max_size=max_size)
+            white_images = StimulusLoader(
+                white_paths, executor=orange_images.executor, max_size=max_size
+            )
+            prefetch_epoch(orange_images, white_images, 0)
+        else:
+            loader = StimulusLoader(orange_paths + white_paths, max_size=max_size)
+            images = loader.load_all()
+            loader.shutdown()
+            orange_images = images[: len(orange_paths)]
+            white_images = images[len(orange_paths) :]
 
         return orange_images, white_images, orange_image_files, white_image_files
     except (pygame.error, FileNotFoundError) as e:
@@ -262,146 +244,52 @@ def load_images(subject_code, condition_code):
         safe_exit()
 
 
-# Load images based on the subject and condition
-orange_images, white_images, orange_image_files, white_image_files = load_images(
-    subject_code, condition_code
-)
-
-# Define reward probabilities based on the orange_first variable
-if orange_first:
-    reward_probabilities = [(0.9, 0.1), (0.1, 0.9)]  # Orange rewarded first
-else:
-    reward_probabilities = [(0.1, 0.9), (0.9, 0.1)]  # White rewarded first
-
-# Initialize pygame and mixer
-pygame.init()
-pygame.mixer.init()
+# In lazy mode, start decoding the image pairs of an epoch in the background
+def prefetch_epoch(orange_images, white_images, epoch):
+    if not isinstance(orange_images, StimulusLoader):
+        return
+    epoch_indices = range(epoch * trials_per_epoch, (epoch + 1) * trials_per_epoch)
+    orange_images.prefetch(i for i in epoch_indices if i < len(orange_images))
+    white_images.prefetch(i for i in epoch_indices if i < len(white_images))
 
-# Set up the display to full screen
-infoObject = pygame.display.Info()
-screen_width, screen_height = infoObject.current_w, infoObject.current_h
-screen = pygame.display.set_mode((screen_width, screen_height), pygame.FULLSCREEN)
-pygame.display.set_caption("Probabilistic Learning Experiment")
 
-# Load feedback images
-happy_img = pygame.image.load(os.path.join("feedback_imgs", "happy.png"))
-sad_img = pygame.image.load(os.path.join("feedback_imgs", "sad.png"))
+# In lazy mode, shut down the thread pool shared by the two loaders
+def shutdown_loaders(orange_images, white_images):
+    for images in (orange_images, white_images):
+        if isinstance(images, StimulusLoader):
+            images.shutdown()
 
 
 # Function to display the mood slider
 def display_mood_slider():
-    pygame.mouse.set_visible(True)
-    manager = pygame_gui.UIManager(
-        (screen_width, screen_height), "data/themes/theme.json"
-    )
-    initial_value = 50
-    slider_rect = pygame.Rect(
-        (screen_width / 2 - 450, screen_height / 2 - 25), (900, 50)
-    )
-    mood_slider = pygame_gui.elements.UIHorizontalSlider(
-        slider_rect, initial_value, (0, 100), manager
-    )
-    slider_changed = False
-
-    def adjust_slider_value(key):
-        nonlocal slider_changed
-        current_value = mood_slider.get_current_value()
-        if key in [pygame.K_d, pygame.K_k]:
-            step = 10 if key == pygame.K_k else -10
-        elif key in [pygame.K_f, pygame.K_j]:
-            step = 1 if key == pygame.K_j else -1
-        else:
-            step = 0
-        new_value = max(0, min(100, current_value + step))
-        mood_slider.set_current_value(new_value)
-        if new_value != initial_value:
-            slider_changed = True
-
-    running = True
-    font = pygame.font.SysFont(None, 24)
-    text_surface_left = font.render("Molto male", True, (0, 0, 0))
-    text_surface_right = font.render("Molto bene", True, (0, 0, 0))
-    text_rect_left = text_surface_left.get_rect(
-        center=(slider_rect.left - 60, slider_rect.centery)
-    )
-    text_rect_right = text_surface_right.get_rect(
-        center=(slider_rect.right + 60, slider_rect.centery)
-    )
-
-    while running:
-        time_delta = pygame.time.Clock().tick(60) / 1000.0
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE:
-                    safe_exit()
-                adjust_slider_value(event.key)
-                if event.key == pygame.K_SPACE and slider_changed:
-                    running = False
-            manager.process_events(event)
-
-        manager.update(time_delta)
-        screen.fill((255, 255, 255))
-        screen.blit(text_surface_left, text_rect_left)
-        screen.blit(text_surface_right, text_rect_right)
-        manager.draw_ui(screen)
-        pygame.display.flip()
-
-    mood_value = mood_slider.get_current_value()
-    pygame.mouse.set_visible(False)
-    return mood_value
-
-
-# Function to play videos based on the condition (surprise or no-surprise)
-def select_videos(video_type):
-    folder_path = "surprise" if video_type == "surprise" else "nosurprise"
-    if folder_path == "surprise":
-        videos = [f"{folder_path}/effect_{i}.mov" for i in range(1, 11)]
-    else:
-        videos = [f"{folder_path}/noeffect_{i}.mov" for i in range(1, 11)]
-    random.shuffle(videos)
-    return cycle(videos)
+    return mood_slider.run()
 
 
-# Function to play a selected video
+# Function to play a selected video. Frames are decoded on a background
+# thread and presented against a monotonic clock; returns the name of the
+# video file played and the number of dropped and late frames.
 def play_video(video_path):
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print("Error: Could not open video.")
-        return None  # Return None if the video couldn't be opened
-
-    resize_needed = (
-        cap.get(cv2.CAP_PROP_FRAME_WIDTH) != screen_width
-        or cap.get(cv2.CAP_PROP_FRAME_HEIGHT) != screen_height
+    # Headless runs show the frames as fast as they are decoded
+    stats = play_video_file(
+        screen,
+        video_path,
+        on_frame=check_for_exit,
+        cache=video_cache,
+        paced=not is_headless(),
     )
+    if stats is None:
+        print("Error: Could not open video.")
+        return None, None  # Return None if the video couldn't be opened
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        if resize_needed:
-            frame = cv2.resize(frame, (screen_width, screen_height))
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        video_surface = pygame.surfarray.make_surface(frame.transpose([1, 0, 2]))
-        screen.blit(video_surface, (0, 0))
-        pygame.display.flip()
-
-        pygame.time.wait(int(1000 / cap.get(cv2.CAP_PROP_FPS)))
-        check_for_exit()
-
-    cap.release()
-    del video_surface, frame  # Explicitly delete the objects
-    gc.collect()  # Invoke garbage collector to reclaim memory
     screen.fill((0, 0, 0))  # Clear the screen after the video
     pygame.display.flip()
 
-    return os.path.basename(video_path)  # Return the name of the video file played
+    return os.path.basename(video_path), stats
 
 
 # Safely exit the experiment
 def safe_exit():
+    trial_logger.close()  # Write any trials still queued
     pygame.mixer.stop()
     pygame.mixer.quit()
     pygame.display.quit()
@@ -410,133 +298,231 @@ def safe_exit():
     sys.exit(0)
 
 
-# Main experiment loop
-trial_results = []
-n_epochs = 2
-trials_per_epoch = 25
-video_trials = [0, 10, 20, 30]
-trial_count = 0
-response_keys = {pygame.K_f: "Left", pygame.K_j: "Right", pygame.K_ESCAPE: "Exit"}
+# Initialize pygame, open the full screen window and load the feedback images.
+# Does nothing if the display is already set up.
+def setup_display(options):
+    global screen, screen_width, screen_height, layout, happy_img, sad_img
+    global feedback_sounds, mood_slider
 
+    if screen is not None:
+        return
 
-# Determine video type from condition
-video_type = video_type_map[condition_code]
+    # Initialize pygame and mixer (with the small buffer of audio.py)
+    audio.pre_init()
+    pygame.init()
+    pygame.mixer.init()
 
-# Select the video cycle based on the condition (surprise or no-surprise)
-videos_to_play = select_videos(video_type)
+    # Set up the display to full screen
+    infoObject = pygame.display.Info()
+    screen_width, screen_height = infoObject.current_w, infoObject.current_h
+    screen, vsync_requested = set_mode(
+        (screen_width, screen_height),
+        pygame.FULLSCREEN,
+        vsync="no-vsync" not in options,
+    )
+    pygame.display.set_caption("Probabilistic Learning Experiment")
+    print(
+        f"vsync: {'requested (SCALED window)' if vsync_requested else 'off'}, "
+        f"measured: {'on' if vsync_requested and vsync_active() else 'off'}, "
+        f"timer resolution: {clock_resolution_ns():.0f} ns"
+    )
+    restrict_events()  # Only key presses and quit events wake up response waits
+    layout = StimulusLayout((screen_width, screen_height))
 
-for epoch in range(n_epochs):
-    # Create indices for tracking which images have been used
-    # We need exactly 25 images per epoch (trials_per_epoch)
-    epoch_start_idx = epoch * trials_per_epoch
-    epoch_end_idx = epoch_start_idx + trials_per_epoch
-    available_indices = list(range(epoch_start_idx, epoch_end_idx))
-    random.shuffle(available_indices)
+    # Load feedback images, converted to the display format
+    happy_img = load_surface(os.path.join("feedback_imgs", "happy.png"))
+    sad_img = load_surface(os.path.join("feedback_imgs", "sad.png"))
 
-    # Determine the most rewarded stimulus for this epoch
-    if orange_first:
-        most_rewarded_stimulus = "orange" if epoch == 0 else "white"
-    else:
-        most_rewarded_stimulus = "white" if epoch == 0 else "orange"
-
-    for trial in range(trials_per_epoch):
-        trial_count += 1
-        check_for_exit()
-
-        # Display fixation cross before each trial
-        display_fixation()
-
-        # Play a video if the trial is one of the video_trials
-        video_file_name = None
-        if trial in video_trials:
-            video_path = next(videos_to_play, None)
-            if video_path:
-                video_file_name = play_video(video_path)
-
-        # Get the next unused image index
-        current_index = available_indices[trial]
-        orange_img = orange_images[current_index]
-        white_img = white_images[current_index]
-        orange_file = orange_image_files[current_index]
-        white_file = white_image_files[current_index]
-
-        # Present images and collect the response
-        (
-            orange_pos,
-            key_pressed,
-            reaction_time,
-            chosen_image,
-            image_left,
-            image_right,
-        ) = display_images_and_get_response(
-            orange_img, white_img, epoch, orange_file, white_file
-        )
-
-        chosen_color = (
-            "Orange"
-            if (key_pressed == "Left" and orange_pos == "Left")
-            or (key_pressed == "Right" and orange_pos == "Right")
-            else "White"
-        )
-        is_correct = determine_reward(epoch, chosen_color)
-
-        # Show feedback after choice
-        screen.fill((255, 255, 255))
-        if is_correct:
-            screen.blit(
-                happy_img,
-                (
-                    screen_width / 2 - happy_img.get_width() / 2,
-                    screen_height / 2 - happy_img.get_height() / 2,
-                ),
-            )
-            play_sound("beeps/pleasant.wav")
-        else:
-            screen.blit(
-                sad_img,
+    # Decode the feedback sounds once, each on its own reserved channel
+    feedback_sounds = audio.get_feedback_sounds()
+
+    # Build the mood slider once; each rating only resets its value
+    mood_slider = MoodSlider(screen, on_escape=safe_exit)
+
+
+# Run a whole PRL session: set up the display, load the stimuli and run the
+# trials, logging each one to the data file. videos gives the order of the
+# videos (e.g. from a schedule made by schedule.py); by default it is random.
+# All random choices are drawn before the first trial from streams seeded by
+# options["seed"] (a new seed if there is none), which is logged with the
+# trials.
+def run_experiment(
+    subject_code, condition_code, orange_first, options, videos=None
+):
+    global trial_logger, reward_probabilities, video_cache
+
+    streams = Streams(options.get("seed"))
+
+    # Use the provided subject_code and condition when generating the filename
+    # for experiment data
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    experiment_filename = os.path.join(
+        options.get("output-folder", ""),
+        f"experiment_data_{subject_code}_{condition_code}_{timestamp}.csv",
+    )
+
+    # Trials are written by a background thread as soon as they are logged
+    trial_logger = TrialLogger(
+        experiment_filename,
+        FIELDNAMES,
+        defaults={
+            "Subject Code": subject_code,
+            "Condition": condition_code,  # Include condition code directly
+            "Video Type": video_type_map[condition_code],  # Include video type
+            "Seed": streams.seed,
+        },
+    )
+
+    # Define reward probabilities based on the orange_first variable
+    reward_probabilities = epoch_reward_probabilities(orange_first)
+
+    setup_display(options)
+
+    # Main experiment loop
+    trial_count = 0
+
+    # Load images based on the subject and condition (after the display is set
+    # up, so that they can be converted to the display format)
+    images = load_images(subject_code, condition_code, lazy="lazy-images" in options)
+    orange_images, white_images, orange_image_files, white_image_files = images
+
+    # Determine video type from condition
+    video_type = video_type_map[condition_code]
+
+    # Draw the image order, positions, fixation durations, videos (based on
+    # the condition, surprise or no-surprise) and reward draws of all trials
+    table = trial_table(streams, video_type, videos)
+
+    # Optionally keep decoded videos in memory so that replays are pure blits
+    # (a cache made for an earlier condition of the same process is kept)
+    if "video-cache" in options or "video-preload" in options:
+        if video_cache is None:
+            budget_mb = float(options.get("video-cache") or DEFAULT_BUDGET_MB)
+            video_cache = VideoCache((screen_width, screen_height), budget_mb)
+        if "video-preload" in options:
+            video_cache.preload(video_files(video_type))
+
+    try:
+        for epoch in range(n_epochs):
+            # In lazy mode, decode the next epoch's images while this one runs
+            prefetch_epoch(orange_images, white_images, epoch + 1)
+
+            # Determine the most rewarded stimulus for this epoch
+            most_rewarded_stimulus = epoch_most_rewarded_stimulus(epoch, orange_first)
+
+            for trial in range(trials_per_epoch):
+                row = table[trial_count]
+                trial_count += 1
+                check_for_exit()
+
+                # Display fixation cross before each trial
+                display_fixation(row["fixation"])
+
+                # Play a video if the trial is one of the VIDEO_TRIALS
+                video_file_name = None
+                video_stats = None
+                if row["video"]:
+                    video_file_name, video_stats = play_video(row["video"])
+
+                # The image pair of the trial (each pair of the epoch is used once)
+                current_index = row["image_index"]
+                orange_img = orange_images[current_index]
+                white_img = white_images[current_index]
+                orange_file = orange_image_files[current_index]
+                white_file = white_image_files[current_index]
+
+                # Present images and collect the response
                 (
-                    screen_width / 2 - sad_img.get_width() / 2,
-                    screen_height / 2 - sad_img.get_height() / 2,
-                ),
-            )
-            play_sound("beeps/unpleasant.wav")
-        pygame.display.flip()
-        pygame.time.wait(500)
+                    orange_pos,
+                    key_pressed,
+                    reaction_time,
+                    chosen_image,
+                    image_left,
+                    image_right,
+                    response_timing_data,
+                ) = display_images_and_get_response(
+                    orange_img,
+                    white_img,
+                    orange_file,
+                    white_file,
+                    row["orange_position"],
+                )
+
+                chosen_color = (
+                    "Orange"
+                    if (key_pressed == "Left" and orange_pos == "Left")
+                    or (key_pressed == "Right" and orange_pos == "Right")
+                    else "White"
+                )
+                is_correct = determine_reward(epoch, chosen_color, row["reward_draw"])
+
+                # Show feedback after choice, starting the sound right after the
+                # flip so that its latency can be measured from the visual onset
+                screen.fill((255, 255, 255))
+                layout.blit(screen, happy_img if is_correct else sad_img, "center")
+                feedback_onset_ns, _ = flip()
+                played_ns = feedback_sounds.play(
+                    "pleasant" if is_correct else "unpleasant"
+                )
+                audio_latency = feedback_sounds.onset_latency(
+                    played_ns, feedback_onset_ns
+                )
+                wait(0.5, on_escape=safe_exit)
+
+                if is_mood_trial(trial_count):
+                    mood_slider_value = display_mood_slider()
+                else:
+                    mood_slider_value = None
+
+                # Store trial data
+                trial_data = {
+                    "Trial Number": trial_count,
+                    "Epoch": epoch + 1,
+                    "Chosen Color": chosen_color,
+                    "Stimulus Position": orange_pos,
+                    "Key Pressed": key_pressed,
+                    "Reaction Time": reaction_time,
+                    "Feedback Received": is_correct,
+                    "Orange First": orange_first,
+                    "Chosen Image": chosen_image,
+                    "Image Left": image_left,
+                    "Image Right": image_right,
+                    "Mood Slider Value": mood_slider_value,
+                    "Video File Name": video_file_name,
+                    "Video Frames Dropped": (
+                        video_stats["dropped"] if video_stats else None
+                    ),
+                    "Video Frames Late": video_stats["late"] if video_stats else None,
+                    "Most Rewarded Stimulus in Epoch": most_rewarded_stimulus,
+                    "Audio Onset Latency (ms)": audio_latency,
+                    **response_timing_data,
+                }
+                trial_logger.log(trial_data)
+    finally:
+        # Stop the decoder threads of lazy loading (run_session runs every
+        # condition in the same process)
+        shutdown_loaders(orange_images, white_images)
+
+    trial_logger.close()  # Write the last trials
+
+    # Ensure cursor is visible when exiting
+    pygame.mouse.set_visible(True)
 
-        if trial_count % 4 == 0:
-            mood_slider_value = display_mood_slider()
-        else:
-            mood_slider_value = None
-
-        # Store trial data
-        trial_data = {
-            "Trial Number": trial_count,
-            "Epoch": epoch + 1,
-            "Chosen Color": chosen_color,
-            "Stimulus Position": orange_pos,
-            "Key Pressed": key_pressed,
-            "Reaction Time": reaction_time,
-            "Feedback Received": is_correct,
-            "Orange First": orange_first,
-            "Chosen Image": chosen_image,
-            "Image Left": image_left,
-            "Image Right": image_right,
-            "Mood Slider Value": mood_slider_value,
-            "Video File Name": video_file_name,
-            "Most Rewarded Stimulus in Epoch": most_rewarded_stimulus,
-        }
-        trial_results.append(trial_data)
-
-        # Save data every 5 trials
-        if trial_count % 5 == 0:
-            save_data(trial_results, filename=experiment_filename)
-            trial_results = []  # Clear trial results after saving to file
-
-# Ensure any remaining data is saved at the end of the experiment
-if trial_results:
-    save_data(trial_results, filename=experiment_filename)
-
-# Ensure cursor is visible when exiting
-pygame.mouse.set_visible(True)
-
-safe_exit()
+
+if __name__ == "__main__":
+    subject_code, condition_code, orange_first, options = parse_args(sys.argv)
+    if options.get("replay"):
+        # Replay the random choices of a saved session
+        try:
+            options["seed"] = str(recorded_seed(options["replay"]))
+        except (OSError, ValueError) as e:
+            print(f"Cannot replay {options['replay']}: {e}")
+            sys.exit(1)
+    if "headless" in options:
+        # Dummy display and sound drivers, and a responder instead of the keyboard
+        headless.start(options.get("responder") or "random", options.get("seed"))
+    if options.get("output-folder"):
+        os.makedirs(options["output-folder"], exist_ok=True)
+
+    run_experiment(subject_code, condition_code, orange_first, options)
+    safe_exit()
@@ -0,0 +1,129 @@
+from itertools import cycle
+
+# Structure of a PRL session, shared by prl_30.py and the simulator: two
+# epochs of 25 trials, with the rewarded colour reversed between them.
+N_EPOCHS = 2
+TRIALS_PER_EPOCH = 25
+
+# Trials (within an epoch, counted from 0) preceded by a video
+VIDEO_TRIALS = [0, 10, 20, 30]
+
+# The mood slider follows every MOOD_EVERY-th trial of the session
+MOOD_EVERY = 4
+
+# Images shown in each condition and type of the videos
+IMAGE_RANGES = {
+    "A": (1, 50),  # Self/surprise: images 1-50
+    "B": (51, 100),  # Self/no-surprise: images 51-100
+    "C": (1, 50),  # Stranger/surprise: images 1-50
+    "D": (51, 100),  # Stranger/no-surprise: images 51-100
+}
+
+VIDEO_TYPES = {
+    "A": "surprise",
+    "B": "nosurprise",
+    "C": "surprise",
+    "D": "nosurprise",
+}
+
+# Columns of the PRL trial CSV
+FIELDNAMES = [
+    "Subject Code",
+    "Condition",
+    "Trial Number",
+    "Epoch",
+    "Chosen Color",
+    "Orange First",
+    "Stimulus Position",
+    "Key Pressed",
+    "Reaction Time",
+    "Feedback Received",
+    "Chosen Image",
+    "Most Rewarded Stimulus in Epoch",
+    "Image Left",
+    "Image Right",
+    "Mood Slider Value",
+    "Video Type",
+    "Video File Name",
+    "Video Frames Dropped",
+    "Video Frames Late",
+    "Stimulus Onset (ns)",
+    "Response Time (ns)",
+    "Flip Latency (ms)",
+    "Audio Onset Latency (ms)",
+    "Seed",
+]
+
+
+# (orange, white) reward probabilities of each epoch
+def reward_probabilities(orange_first):
+    if orange_first:
+        return [(0.9, 0.1), (0.1, 0.9)]  # Orange rewarded first
+    return [(0.1, 0.9), (0.9, 0.1)]  # White rewarded first
+
+
+def most_rewarded_stimulus(epoch, orange_first):
+    if orange_first:
+        return "orange" if epoch == 0 else "white"
+    return "white" if epoch == 0 else "orange"
+
+
+# The video files of a video type (surprise or nosurprise)
+def video_files(video_type):
+    folder_path = "surprise" if video_type == "surprise" else "nosurprise"
+    if folder_path == "surprise":
+        return [f"{folder_path}/effect_{i}.mov" for i in range(1, 11)]
+    return [f"{folder_path}/noeffect_{i}.mov" for i in range(1, 11)]
+
+
+def is_video_trial(trial):
+    return trial in VIDEO_TRIALS
+
+
+def is_mood_trial(trial_count):
+    return trial_count % MOOD_EVERY == 0
+
+
+def reward_probability(probabilities, epoch, stimulus_color):
+    # Extract the reward probabilities for the current epoch
+    probs = probabilities[epoch]
+
+    # Determine the probability of reward based on the chosen color
+    return probs[0] if stimulus_color == "Orange" else probs[1]
+
+
+# Every random decision of a PRL session, drawn ahead of time from the
+# streams of rng.Streams: one row per trial with the index of the image pair,
+# the side of the orange image, the fixation duration, the video played
+# before the trial (or None) and the draw that decides the reward (rewarded
+# if it is below the reward probability of the chosen colour). videos gives
+# the video order; by default it is random.
+def trial_table(streams, video_type, videos=None):
+    if videos is None:
+        videos = video_files(video_type)
+        streams["videos"].shuffle(videos)
+    videos_to_play = cycle(videos)
+
+    table = []
+    for epoch in range(N_EPOCHS):
+        # Each image pair of the epoch once, in random order
+        image_indices = list(
+            range(epoch * TRIALS_PER_EPOCH, (epoch + 1) * TRIALS_PER_EPOCH)
+        )
+        streams["images"].shuffle(image_indices)
+        for trial in range(TRIALS_PER_EPOCH):
+            table.append(
+                {
+                    "epoch": epoch,
+                    "trial": trial,
+                    "image_index": image_indices[trial],
+                    "orange_position": streams["positions"].choice(
+                        ["Left", "Right"]
+                    ),
+                    # Random duration between 0.25 and 1.25 seconds
+                    "fixation": streams["fixation"].uniform(0.25, 1.25),
+                    "video": next(videos_to_play) if is_video_trial(trial) else None,
+                    "reward_draw": streams["rewards"].random(),
+                }
+            )
+    return table
@@ -0,0 +1,91 @@
+import time
+import pygame
+
+# The only events the tasks react to while waiting for a response
+RESPONSE_EVENTS = [pygame.KEYDOWN, pygame.QUIT]
+
+# Events the pygame_gui mood slider needs on top of RESPONSE_EVENTS
+GUI_EVENTS = [
+    pygame.MOUSEMOTION,
+    pygame.MOUSEBUTTONDOWN,
+    pygame.MOUSEBUTTONUP,
+    pygame.MOUSEWHEEL,
+    pygame.KEYUP,
+    pygame.TEXTINPUT,
+]
+
+# In headless runs a responder (see headless.py) answers instead of the
+# keyboard: a callable that gets the accepted keys and returns one of them
+_responder = None
+
+
+def set_responder(responder):
+    global _responder
+    _responder = responder
+
+
+def is_headless():
+    return _responder is not None
+
+
+# Let the responder press one of the keys by putting the key event on the
+# queue, for loops that read events themselves (the mood slider)
+def post_response(keys):
+    key = _responder(keys)
+    pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=key, mod=0))
+    return key
+
+
+# Keep every other event (mouse motion, window events, ...) out of the queue
+# so that waiting threads are only woken up by events that matter
+def restrict_events():
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed(RESPONSE_EVENTS)
+
+
+# Let the events of the pygame_gui mood slider through, and block them again.
+# Only these types are toggled: set_allowed(None) and set_blocked(None) go
+# through every SDL event type and take tens of milliseconds.
+def allow_gui_events():
+    pygame.event.set_allowed(GUI_EVENTS)
+
+
+def block_gui_events():
+    pygame.event.set_blocked(GUI_EVENTS)
+
+
+# Block until one of the keys is pressed or the timeout (in seconds) expires.
+# The thread sleeps in pygame.event.wait instead of polling, so waiting costs
+# no CPU. Returns the key and the time.perf_counter_ns() timestamp taken when
+# the key event woke us up, or (None, None) on timeout. Escape and window close
+# call on_escape, if given, and are otherwise ignored. With a responder set,
+# there is no waiting at all: it answers at once, and plain waits return.
+def wait_for_key(keys, timeout=None, on_escape=None):
+    if _responder is not None:
+        key = _responder(keys) if keys else None
+        return (key, time.perf_counter_ns()) if key is not None else (None, None)
+
+    deadline = None if timeout is None else time.perf_counter() + timeout
+    while True:
+        if deadline is None:
+            event = pygame.event.wait()
+        else:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return None, None
+            # Round up, so that we never wake up before the deadline
+            event = pygame.event.wait(int(remaining * 1000) + 1)
+        timestamp = time.perf_counter_ns()
+
+        if event.type == pygame.QUIT or (
+            event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE
+        ):
+            if on_escape is not None:
+                on_escape()
+        elif event.type == pygame.KEYDOWN and event.key in keys:
+            return event.key, timestamp
+
+
+# Sleep for a duration (in seconds) while still reacting to Escape
+def wait(duration, on_escape=None):
+    wait_for_key((), timeout=duration, on_escape=on_escape)
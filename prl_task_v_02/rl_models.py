@@ -0,0 +1,373 @@
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import session_store
+
+# Reinforcement-learning models of the PRL choices. Every model keeps one
+# value per colour (orange, white), starting at INITIAL_VALUE, updates the
+# chosen one with a Rescorla-Wagner rule and chooses with a softmax:
+#
+#   rw          alpha, beta
+#   rw_valence  alpha_pos, alpha_neg, beta  (separate rates after reward and
+#               no reward, i.e. positive and negative prediction errors)
+#   reversal    alpha_pos, alpha_neg, beta  plus a counterfactual update of
+#               the unchosen colour towards the opposite outcome, since in
+#               this task exactly one colour is the better one
+#
+# The likelihood is computed for all sessions and all parameter sets at once:
+# parameters are arrays of shape (n_sets, n_sessions), the only Python loop
+# is over trials.
+MODELS = {
+    "rw": ["alpha", "beta"],
+    "rw_valence": ["alpha_pos", "alpha_neg", "beta"],
+    "reversal": ["alpha_pos", "alpha_neg", "beta"],
+}
+
+INITIAL_VALUE = 0.5
+MAX_BETA = 30.0
+COLORS = ["Orange", "White"]
+
+
+# Parameters are optimised in an unbounded space and mapped to their range:
+# learning rates to (0, 1), the inverse temperature to (0, MAX_BETA)
+def to_params(model, x):
+    bounded = 1 / (1 + np.exp(-x))
+    params = {}
+    for i, name in enumerate(MODELS[model]):
+        scale = MAX_BETA if name == "beta" else 1.0
+        params[name] = scale * bounded[..., i]
+    if model == "rw":
+        params["alpha_pos"] = params["alpha_neg"] = params["alpha"]
+    return params
+
+
+# Update the values (..., 2) in place after a choice (0 = orange, 1 = white)
+# and its reward; only where valid is true. Returns the value of the chosen
+# colour before the update and the prediction error.
+def update_values(
+    values, choice, reward, alpha_pos, alpha_neg, counterfactual, valid=True
+):
+    chosen = np.where(choice == 1, values[..., 1], values[..., 0])
+    rpe = reward - chosen
+    alpha = np.where(rpe > 0, alpha_pos, alpha_neg)
+    update = np.where(valid, alpha * rpe, 0)
+    values[..., 0] += np.where(choice == 0, update, 0)
+    values[..., 1] += np.where(choice == 1, update, 0)
+
+    if counterfactual:
+        unchosen = np.where(choice == 1, values[..., 0], values[..., 1])
+        cf_rpe = (1 - reward) - unchosen
+        cf_alpha = np.where(cf_rpe > 0, alpha_pos, alpha_neg)
+        cf_update = np.where(valid, cf_alpha * cf_rpe, 0)
+        values[..., 0] += np.where(choice == 1, cf_update, 0)
+        values[..., 1] += np.where(choice == 0, cf_update, 0)
+
+    return chosen, rpe
+
+
+# Run the model over the trials. choices and rewards are (n_sessions,
+# n_trials) arrays (choice 0 = orange, 1 = white) and mask marks the real
+# trials of sessions shorter than the longest one. Returns the negative log
+# likelihood per parameter set and session and, if asked, the trial-wise
+# prediction errors and values (with the parameter sets axis first).
+def run_model(model, params, choices, rewards, mask, trace=False):
+    alpha_pos = params["alpha_pos"]
+    alpha_neg = params["alpha_neg"]
+    beta = params["beta"]
+    counterfactual = model == "reversal"
+
+    shape = np.broadcast_shapes(alpha_pos.shape, beta.shape)
+    values = np.full(shape + (2,), INITIAL_VALUE)
+    nll = np.zeros(shape)
+    n_trials = choices.shape[1]
+    if trace:
+        rpes = np.full(shape + (n_trials,), np.nan)
+        chosen_values = np.full(shape + (n_trials,), np.nan)
+
+    for t in range(n_trials):
+        choice = choices[:, t]
+        reward = rewards[:, t]
+        valid = mask[:, t]
+
+        # Softmax over two options: p(white) = sigmoid(beta * (Q_white - Q_orange))
+        diff = beta * (values[..., 1] - values[..., 0])
+        signed = np.where(choice == 1, diff, -diff)
+        # -log(sigmoid(signed)), computed without overflow
+        nll += np.where(valid, np.logaddexp(0, -signed), 0)
+
+        chosen, rpe = update_values(
+            values, choice, reward, alpha_pos, alpha_neg, counterfactual, valid
+        )
+
+        if trace:
+            rpes[..., t] = np.where(valid, rpe, np.nan)
+            chosen_values[..., t] = np.where(valid, chosen, np.nan)
+
+    if trace:
+        return nll, rpes, chosen_values
+    return nll
+
+
+def negative_log_likelihood(model, x, data):
+    return run_model(
+        model, to_params(model, x), data["choices"], data["rewards"], data["mask"]
+    )
+
+
+# Minimise the negative log likelihood from a batch of starting points
+# x0 (n_starts, n_sessions, n_params) with Adam on central finite-difference
+# gradients. All the starts still running, their sessions and the
+# 2 * n_params + 1 evaluations of each step go through a single vectorised
+# run_model call. A start has converged once its NLL has changed by less than
+# tol for patience steps in a row, and is then left out of later steps.
+# Returns x, the NLL and whether each start converged within n_steps.
+def fit_starts(
+    model,
+    x0,
+    data,
+    n_steps=300,
+    learning_rate=0.1,
+    eps=1e-4,
+    tol=3e-4,
+    patience=5,
+):
+    x = np.array(x0, dtype=np.float64)
+    n_params = x.shape[-1]
+    offsets = np.concatenate([np.zeros((1, n_params)), eps * np.eye(n_params)])
+    offsets = np.concatenate([offsets, -offsets[1:]])
+    m = np.zeros_like(x)
+    v = np.zeros_like(x)
+    previous = np.full(x.shape[:-1], np.inf)
+    stalled = np.zeros(x.shape[:-1], dtype=np.int64)
+    converged = np.zeros(x.shape[:-1], dtype=np.bool_)
+
+    for step in range(1, n_steps + 1):
+        active = np.nonzero(~converged)
+        if not len(active[0]):
+            break
+        # The running starts as one flat batch, each with its session's data
+        sessions = active[1]
+        batch = {key: data[key][sessions] for key in ("choices", "rewards", "mask")}
+        points = x[active][None] + offsets[:, None, :]
+        nll = negative_log_likelihood(model, points, batch)
+        grad = (nll[1 : n_params + 1] - nll[n_params + 1 :]) / (2 * eps)
+        grad = np.moveaxis(grad, 0, -1)
+
+        stalled[active] = np.where(
+            np.abs(previous[active] - nll[0]) < tol, stalled[active] + 1, 0
+        )
+        previous[active] = nll[0]
+        converged[active] = stalled[active] >= patience
+
+        m[active] = 0.9 * m[active] + 0.1 * grad
+        v[active] = 0.999 * v[active] + 0.001 * grad**2
+        m_hat = m[active] / (1 - 0.9**step)
+        v_hat = v[active] / (1 - 0.999**step)
+        x[active] -= learning_rate * m_hat / (np.sqrt(v_hat) + 1e-8)
+
+    return x, negative_log_likelihood(model, x, data), converged
+
+
+# Runs in the worker processes: fit one chunk of starts, keep the best per
+# session
+def _fit_chunk(args):
+    model, x0, data = args
+    x, nll, converged = fit_starts(model, x0, data)
+    best = np.argmin(nll, axis=0)
+    sessions = np.arange(x.shape[1])
+    return x[best, sessions], nll[best, sessions], converged[best, sessions]
+
+
+# Multi-start maximum likelihood fit of every session. Starting points are
+# drawn from a normal distribution in the unbounded space and split across a
+# process pool; each worker fits its chunk for all sessions at once.
+def fit(model, data, n_starts=20, workers=None, seed=0):
+    rng = np.random.default_rng(seed)
+    n_sessions = data["choices"].shape[0]
+    n_params = len(MODELS[model])
+    x0 = rng.normal(0, 1.5, size=(n_starts, n_sessions, n_params))
+
+    n_workers = min(workers or os.cpu_count() or 1, n_starts)
+    chunks = np.array_split(x0, n_workers)
+    if n_workers == 1:
+        results = [_fit_chunk((model, chunks[0], data))]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results = list(
+                executor.map(_fit_chunk, [(model, c, data) for c in chunks])
+            )
+
+    xs = np.stack([x for x, _, _ in results])
+    nlls = np.stack([nll for _, nll, _ in results])
+    convergeds = np.stack([converged for _, _, converged in results])
+    best = np.argmin(nlls, axis=0)
+    sessions = np.arange(n_sessions)
+    x = xs[best, sessions]
+    nll = nlls[best, sessions]
+
+    n_trials = data["mask"].sum(axis=1)
+    params = to_params(model, x)
+    return {
+        "params": {name: params[name] for name in MODELS[model]},
+        "nll": nll,
+        "bic": 2 * nll + n_params * np.log(n_trials),
+        "x": x,
+        # False when the best start hit n_steps without converging
+        "converged": convergeds[best, sessions],
+    }
+
+
+# Trial-wise prediction errors and chosen values with the fitted parameters,
+# shape (n_sessions, n_trials)
+def trial_rpes(model, x, data):
+    params = to_params(model, x)
+    _, rpes, chosen_values = run_model(
+        model, params, data["choices"], data["rewards"], data["mask"], trace=True
+    )
+    return rpes, chosen_values
+
+
+# Turn PRL trial columns (as returned by session_store.load) into padded
+# arrays, one row per session ordered by trial number
+def choice_data(columns):
+    keys = list(
+        zip(columns["Subject Code"], columns["Condition"], columns["Session"])
+    )
+    sessions = sorted(set(keys))
+    index = {key: i for i, key in enumerate(sessions)}
+    session_index = np.array([index[key] for key in keys], dtype=np.int64)
+
+    order = np.lexsort((columns["Trial Number"], session_index))
+    session_index = session_index[order]
+    counts = np.bincount(session_index, minlength=len(sessions))
+    n_trials = counts.max() if len(counts) else 0
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    position = np.arange(len(order)) - starts[session_index]
+
+    choices = np.zeros((len(sessions), n_trials), dtype=np.int8)
+    rewards = np.zeros((len(sessions), n_trials))
+    mask = np.zeros((len(sessions), n_trials), dtype=np.bool_)
+    chosen_color = columns["Chosen Color"][order]
+    choices[session_index, position] = chosen_color == COLORS[1]
+    rewards[session_index, position] = columns["Feedback Received"][order]
+    mask[session_index, position] = np.isin(chosen_color, COLORS)
+
+    return {
+        "sessions": sessions,
+        "choices": choices,
+        "rewards": rewards,
+        "mask": mask,
+        "trial_numbers": columns["Trial Number"][order],
+        "session_index": session_index,
+        "position": position,
+    }
+
+
+def load_choice_data(store_folder=session_store.STORE_FOLDER, subjects=None):
+    columns = session_store.load(
+        "prl",
+        columns=[
+            "Subject Code",
+            "Condition",
+            "Session",
+            "Trial Number",
+            "Chosen Color",
+            "Feedback Received",
+        ],
+        subjects=subjects,
+        store_folder=store_folder,
+    )
+    return choice_data(columns)
+
+
+def write_fits(filename, model, data, result):
+    names = MODELS[model]
+    with open(filename, mode="w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(
+            [
+                "Subject Code",
+                "Condition",
+                "Session",
+                "Model",
+                *names,
+                "NLL",
+                "BIC",
+                "Converged",
+            ]
+        )
+        for i, session in enumerate(data["sessions"]):
+            writer.writerow(
+                [
+                    *session,
+                    model,
+                    *(round(float(result["params"][name][i]), 6) for name in names),
+                    round(float(result["nll"][i]), 4),
+                    round(float(result["bic"][i]), 4),
+                    bool(result["converged"][i]),
+                ]
+            )
+
+
+def write_rpes(filename, model, data, rpes, chosen_values):
+    with open(filename, mode="w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(
+            [
+                "Subject Code",
+                "Condition",
+                "Session",
+                "Trial Number",
+                "Model",
+                "Chosen Value",
+                "Prediction Error",
+            ]
+        )
+        for i, p, trial in zip(
+            data["session_index"], data["position"], data["trial_numbers"]
+        ):
+            writer.writerow(
+                [
+                    *data["sessions"][i],
+                    trial,
+                    model,
+                    round(float(chosen_values[i, p]), 6),
+                    round(float(rpes[i, p]), 6),
+                ]
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fit RL models to the PRL sessions in the session store"
+    )
+    parser.add_argument("--model", choices=sorted(MODELS), default="rw_valence")
+    parser.add_argument("--store", default=session_store.STORE_FOLDER)
+    parser.add_argument("--subjects", nargs="*", help="only these subjects")
+    parser.add_argument("--starts", type=int, default=20, help="starting points")
+    parser.add_argument("--workers", type=int, help="number of processes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="rl_fits.csv")
+    parser.add_argument("--rpes", help="also write trial-wise prediction errors")
+    args = parser.parse_args()
+
+    data = load_choice_data(args.store, args.subjects)
+    if not data["sessions"]:
+        raise SystemExit(f"No PRL sessions in {args.store}")
+
+    start_time = time.time()
+    result = fit(args.model, data, args.starts, args.workers, args.seed)
+    write_fits(args.output, args.model, data, result)
+    print(
+        f"Fitted {args.model} to {len(data['sessions'])} sessions "
+        f"in {time.time() - start_time:.1f} s"
+    )
+    n_unconverged = int(np.sum(~result["converged"]))
+    if n_unconverged:
+        print(f"{n_unconverged} fits did not converge (Converged = False)")
+    if args.rpes:
+        rpes, chosen_values = trial_rpes(args.model, result["x"], data)
+        write_rpes(args.rpes, args.model, data, rpes, chosen_values)
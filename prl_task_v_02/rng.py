@@ -0,0 +1,55 @@
+import csv
+import hashlib
+import random
+
+# Random number streams of the tasks. Every random decision of a session is
+# drawn from the stream of its subsystem, and the seed of each stream is
+# derived from one session seed (a hash of the seed and the stream name), so
+# the streams are independent of each other and of the order in which they
+# are used. The session seed is written in the "Seed" column of the data
+# files; running a task again with --seed=<that seed> (or --replay=<file>)
+# gives the same image order, positions, fixation durations, videos, reward
+# draws, foils and intervals.
+STREAMS = [
+    "images",  # PRL: order of the image pairs in each epoch
+    "positions",  # PRL: side of the orange image
+    "fixation",  # PRL: fixation durations
+    "videos",  # PRL: order of the videos
+    "rewards",  # PRL: reward draws
+    "memory_trials",  # Memory: foils, sides and order of the trials
+    "memory_isi",  # Memory: blank intervals before each trial
+]
+
+
+def derive_seed(seed, name):
+    digest = hashlib.sha256(f"{seed}/{name}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "little")
+
+
+def new_seed():
+    return random.SystemRandom().randrange(2**32)
+
+
+class Streams:
+    # seed can be an int, a string of digits (as in --seed=N) or None for a
+    # fresh seed, which is then recorded like a given one
+    def __init__(self, seed=None):
+        self.seed = new_seed() if seed in (None, "") else int(seed)
+        self.generators = {
+            name: random.Random(derive_seed(self.seed, name)) for name in STREAMS
+        }
+
+    def __getitem__(self, name):
+        return self.generators[name]
+
+
+# Seed recorded in a data file of an earlier session
+def recorded_seed(path):
+    with open(path, newline="") as file:
+        row = next(csv.DictReader(file), None)
+    if row is None or not row.get("Seed"):
+        raise ValueError(
+            f"No seed recorded in {path} (files saved before the Seed column "
+            "cannot be replayed)"
+        )
+    return int(row["Seed"])
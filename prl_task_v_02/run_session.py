@@ -0,0 +1,179 @@
+import argparse
+import os
+import random
+import sys
+import time
+import headless
+import prl_30
+import memory_task_02
+from catalog import get_catalog
+from rng import derive_seed, new_seed
+from prl_schedule import IMAGE_RANGES
+from schedule import load_schedule, subject_sessions
+from stimuli import prefetch_images, discard_prefetched
+
+# A subject's whole session in one process: the four PRL conditions in a
+# random order, each with a random orange_first (as gen_seq_conditions.R
+# prints them), and each followed by its memory test. pygame, the window, the
+# mixer, the feedback images and sounds, the mood slider and the video cache
+# are set up once for all of them, and while a condition runs, the images of
+# its memory test and of the next condition are decoded on a background
+# thread.
+#
+#   python3 run_session.py subject_1
+#   python3 run_session.py subject_1 --order A:T,C:F,B:F,D:T --video-cache
+#   python3 run_session.py subject_001 --schedule schedule.json
+#
+# With --schedule, the order, orange_first and video order of the subject
+# come from a schedule made by schedule.py.
+#
+# Each condition gets its own seed (see rng.py), derived from the session
+# seed (--seed=N, or a new one, which is printed) and the condition code, so a
+# condition has the same trials whatever its position in the order.
+#
+# Options not listed below are passed to prl_30.py (and, for --headless,
+# --responder, --seed and --output-folder, to the memory task too).
+CONDITIONS = ["A", "B", "C", "D"]
+
+PRL_FOLDERS = ["old_orange", "old_white"]
+MEMORY_FOLDERS = ["new_orange", "new_white"]
+
+
+# The conditions to run, as in the sessions of a schedule.py schedule:
+# [{"condition": "A", "orange_first": True}, ...], with the conditions
+# shuffled and orange_first drawn for each one
+def random_order(rng=random):
+    order = [
+        {"condition": code, "orange_first": rng.choice([True, False])}
+        for code in CONDITIONS
+    ]
+    rng.shuffle(order)
+    return order
+
+
+# "A:T,C:F" -> [{"condition": "A", "orange_first": True},
+#               {"condition": "C", "orange_first": False}]
+def parse_order(text):
+    order = []
+    for item in text.split(","):
+        condition_code, orange_first = item.split(":")
+        if condition_code not in CONDITIONS or orange_first not in ("T", "F"):
+            raise ValueError(f"Invalid condition '{item}' (expected e.g. A:T)")
+        order.append({"condition": condition_code, "orange_first": orange_first == "T"})
+    return order
+
+
+# Paths of the images of a condition in the given stimulus folders
+def condition_images(subject_code, condition_code, stimulus_folders):
+    start, end = IMAGE_RANGES[condition_code]
+    folder_type = "self" if condition_code in ["A", "B"] else "stranger"
+    subject_folder = f"{subject_code}_{folder_type}"
+    catalog = get_catalog()
+    return [
+        catalog.path(subject_folder, stimulus_folder, filename)
+        for stimulus_folder in stimulus_folders
+        for filename in catalog.filenames(subject_folder, stimulus_folder, start, end)
+    ]
+
+
+def run_session(subject_code, order, options, memory=True, seed=None):
+    output_folder = options.get("output-folder", "")
+    seed = new_seed() if seed is None else seed
+    prl_30.setup_display(options)
+    max_size = prl_30.layout.max_stimulus_size()
+    memory_folders = MEMORY_FOLDERS if memory else []
+
+    for n, session in enumerate(order):
+        condition_code = session["condition"]
+        # The images of the first condition are loaded by prl_30 itself; later
+        # ones were prefetched while the previous condition ran
+        prefetch_images(
+            condition_images(subject_code, condition_code, memory_folders), max_size
+        )
+        if n + 1 < len(order):
+            prefetch_images(
+                condition_images(
+                    subject_code,
+                    order[n + 1]["condition"],
+                    PRL_FOLDERS + memory_folders,
+                ),
+                max_size,
+            )
+
+        condition_seed = derive_seed(seed, condition_code)
+        start_time = time.time()
+        prl_30.run_experiment(
+            subject_code,
+            condition_code,
+            session["orange_first"],
+            {**options, "seed": condition_seed},
+            videos=session.get("videos"),
+        )
+        print(f"PRL {condition_code}: {time.time() - start_time:.1f} s")
+        if memory:
+            start_time = time.time()
+            memory_task_02.run_memory_task(
+                subject_code,
+                condition_code,
+                output_folder,
+                quit_pygame=False,
+                seed=condition_seed,
+            )
+            print(f"Memory {condition_code}: {time.time() - start_time:.1f} s")
+
+        discard_prefetched(
+            condition_images(subject_code, condition_code, PRL_FOLDERS + memory_folders)
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the PRL conditions and memory tests of a subject",
+        epilog="Other --options are passed to prl_30.py, e.g. --video-cache, "
+        "--no-vsync, --headless, --responder=SPEC, --seed=N, --output-folder=DIR",
+    )
+    parser.add_argument("subject_code")
+    order_group = parser.add_mutually_exclusive_group()
+    order_group.add_argument(
+        "--order", help="conditions and orange_first, e.g. A:T,C:F,B:F,D:T"
+    )
+    order_group.add_argument("--schedule", help="schedule file from schedule.py")
+    parser.add_argument(
+        "--no-memory", action="store_true", help="run the PRL conditions only"
+    )
+    args, task_args = parser.parse_known_args()
+    options = dict(
+        arg[2:].split("=", 1) if "=" in arg else (arg[2:], "")
+        for arg in task_args
+        if arg.startswith("--")
+    )
+
+    seed = int(options["seed"]) if options.get("seed") else new_seed()
+    print(f"Session seed: {seed}")
+    if "headless" in options:
+        # Dummy display and sound drivers, and a responder instead of the keyboard
+        headless.start(options.get("responder") or "random", options.get("seed"))
+    if options.get("output-folder"):
+        os.makedirs(options["output-folder"], exist_ok=True)
+
+    try:
+        if args.schedule:
+            order = subject_sessions(load_schedule(args.schedule), args.subject_code)
+        elif args.order:
+            order = parse_order(args.order)
+        else:
+            order = random_order(random.Random(seed))
+    except (ValueError, KeyError, OSError) as e:
+        sys.exit(str(e))
+    for session in order:
+        print(
+            f"{session['condition']} ({prl_30.condition_map[session['condition']]}), "
+            f"{'orange' if session['orange_first'] else 'white'} rewarded first"
+        )
+
+    start_time = time.time()
+    run_session(
+        args.subject_code, order, options, memory=not args.no_memory, seed=seed
+    )
+    print(f"Session done in {time.time() - start_time:.1f} s")
+    prl_30.safe_exit()
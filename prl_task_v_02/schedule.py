@@ -0,0 +1,166 @@
+import argparse
+import csv
+import json
+import random
+import time
+from rng import new_seed
+from prl_schedule import (
+    TRIALS_PER_EPOCH,
+    VIDEO_TRIALS,
+    VIDEO_TYPES,
+    video_files,
+)
+
+# Counterbalanced session plans for a whole study, replacing the commands
+# printed by gen_seq_conditions.R. The condition orders are the rows of a
+# Williams design (a Latin square in which every condition also follows every
+# other condition once). Every block of eight subjects gets each row twice,
+# once with each orange_first pattern: two of a subject's conditions start
+# with orange rewarded and two with white, and over the block each condition
+# starts with orange four times. The rows are dealt out in a random order
+# within each block, and each session gets a random video order. Everything
+# is drawn from one seed, so the same seed gives the same schedule; without
+# --seed a new one is drawn, and it is stored in the schedule and printed.
+#
+#   python3 schedule.py --subjects 200 --seed 1 --output schedule.json
+#   python3 run_session.py subject_001 --schedule schedule.json
+CONDITIONS = ["A", "B", "C", "D"]
+
+# The two orange_first patterns, by position in the order
+ORANGE_FIRST_PATTERNS = [[True, False, False, True], [False, True, True, False]]
+
+
+# Rows of a Williams design for n conditions (n even): each condition appears
+# once at every position and once right after every other condition
+def williams_square(n):
+    first = [0]
+    low, high = 1, n - 1
+    while len(first) < n:
+        first.append(low)
+        low += 1
+        if len(first) < n:
+            first.append(high)
+            high -= 1
+    return [[(c + shift) % n for c in first] for shift in range(n)]
+
+
+# Trials (within an epoch) that are preceded by a video
+def video_trials():
+    return [trial for trial in VIDEO_TRIALS if trial < TRIALS_PER_EPOCH]
+
+
+def make_schedule(subject_codes, seed=None):
+    seed = new_seed() if seed is None else seed
+    rng = random.Random(seed)
+    rows = williams_square(len(CONDITIONS))
+    block = 2 * len(rows)
+
+    subjects = []
+    for block_start in range(0, len(subject_codes), block):
+        # Two copies of the square, one for each orange_first pattern,
+        # shuffled together
+        plans = [(row, pattern) for pattern in range(2) for row in range(len(rows))]
+        rng.shuffle(plans)
+        for subject_code, (row, pattern) in zip(
+            subject_codes[block_start : block_start + block], plans
+        ):
+            sessions = []
+            for position, condition_index in enumerate(rows[row]):
+                condition_code = CONDITIONS[condition_index]
+                videos = video_files(VIDEO_TYPES[condition_code])
+                rng.shuffle(videos)
+                sessions.append(
+                    {
+                        "position": position + 1,
+                        "condition": condition_code,
+                        "orange_first": ORANGE_FIRST_PATTERNS[pattern][position],
+                        "videos": videos,
+                    }
+                )
+            subjects.append(
+                {
+                    "subject_code": subject_code,
+                    "row": row + 1,
+                    "orange_first_pattern": pattern + 1,
+                    "sessions": sessions,
+                }
+            )
+
+    return {
+        "seed": seed,
+        "design": "williams",
+        "video_trials": video_trials(),
+        "subjects": subjects,
+    }
+
+
+def write_json(schedule, path):
+    with open(path, "w") as schedule_file:
+        json.dump(schedule, schedule_file, indent=1)
+
+
+# One row per subject and condition, e.g. for a quick look in R or a
+# spreadsheet
+def write_csv(schedule, path):
+    with open(path, mode="w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(
+            ["Subject Code", "Position", "Condition", "Orange First", "Videos"]
+        )
+        for subject in schedule["subjects"]:
+            for session in subject["sessions"]:
+                writer.writerow(
+                    [
+                        subject["subject_code"],
+                        session["position"],
+                        session["condition"],
+                        "T" if session["orange_first"] else "F",
+                        ";".join(session["videos"]),
+                    ]
+                )
+
+
+def load_schedule(path):
+    with open(path) as schedule_file:
+        return json.load(schedule_file)
+
+
+# The sessions planned for one subject
+def subject_sessions(schedule, subject_code):
+    for subject in schedule["subjects"]:
+        if subject["subject_code"] == subject_code:
+            return subject["sessions"]
+    raise KeyError(f"{subject_code} is not in the schedule")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Make counterbalanced condition orders for a study"
+    )
+    subjects = parser.add_mutually_exclusive_group(required=True)
+    subjects.add_argument("--subjects", type=int, help="number of subjects")
+    subjects.add_argument("--subject-codes", nargs="+", help="explicit codes")
+    parser.add_argument("--prefix", default="subject_", help="of numbered codes")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--output", default="schedule.json")
+    parser.add_argument("--csv", help="also write the schedule as CSV")
+    args = parser.parse_args()
+
+    if args.subject_codes:
+        subject_codes = args.subject_codes
+    else:
+        width = max(3, len(str(args.subjects)))
+        subject_codes = [
+            f"{args.prefix}{n:0{width}d}" for n in range(1, args.subjects + 1)
+        ]
+
+    start_time = time.perf_counter()
+    schedule = make_schedule(subject_codes, args.seed)
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
+    write_json(schedule, args.output)
+    if args.csv:
+        write_csv(schedule, args.csv)
+    print(
+        f"{args.output}: {len(subject_codes)} subjects in {elapsed_ms:.1f} ms, "
+        f"seed {schedule['seed']}"
+    )
@@ -0,0 +1,286 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+import numpy as np
+
+# Consolidated, typed copy of the per-session CSVs. All the sessions of a
+# subject and condition are compacted into one .npz file with one array per
+# column (the rows of every session, ordered by session):
+#
+#   session_store/<task>/<subject>/<condition>.npz
+#
+# Ingesting is append-only: a registry remembers which CSVs (by size and
+# mtime) are already in the store, so re-running the ingest only converts
+# new or grown files, and each partition they belong to is rewritten once
+# with their rows added (replacing the earlier rows of a grown session).
+# np.load() reads the arrays of an .npz lazily, so load() opens one file per
+# partition and only parses the columns that are asked for.
+STORE_FOLDER = "session_store"
+REGISTRY_NAME = "ingested.json"
+
+# experiment_data_<subject>_<condition>_<YYYYmmdd_HHMMSS>.csv (prl_30.py) and
+# memory_task_<subject>_<condition>_<YYYYmmdd_HHMMSS>.csv (memory tasks).
+# Subject codes may contain underscores, the condition never does.
+CSV_NAME = re.compile(
+    r"^(?P<prefix>experiment_data|memory_task)_(?P<subject>.+)_"
+    r"(?P<condition>[^_]+)_(?P<session>\d{8}_\d{6})\.csv$"
+)
+TASKS = {"experiment_data": "prl", "memory_task": "memory"}
+
+# Column types. "int" and "bool" columns must always have a value; columns
+# that can be empty (no key pressed, no video, no mood rating) are "float",
+# with NaN for missing values. Columns not listed here are stored as "str".
+SCHEMAS = {
+    "prl": {
+        "Trial Number": "int",
+        "Epoch": "int",
+        "Orange First": "bool",
+        "Reaction Time": "float",
+        "Feedback Received": "bool",
+        "Mood Slider Value": "float",
+        "Video Frames Dropped": "float",
+        "Video Frames Late": "float",
+        "Stimulus Onset (ns)": "float",
+        "Response Time (ns)": "float",
+        "Flip Latency (ms)": "float",
+        "Audio Onset Latency (ms)": "float",
+        "Seed": "float",
+    },
+    "memory": {
+        "Trial Number": "int",
+        "Correct": "bool",
+        "Reaction Time": "float",
+        "Stimulus Onset (ns)": "float",
+        "Response Time (ns)": "float",
+        "Flip Latency (ms)": "float",
+        "Seed": "float",
+    },
+}
+
+MISSING = {"", "None", "nan"}
+
+
+def parse_csv_name(path):
+    match = CSV_NAME.match(os.path.basename(path))
+    if match is None:
+        return None
+    task = TASKS[match["prefix"]]
+    return task, match["subject"], match["condition"], match["session"]
+
+
+def _column(values, kind):
+    if kind == "int":
+        return np.array([int(v) for v in values], dtype=np.int64)
+    if kind == "bool":
+        return np.array([v == "True" for v in values], dtype=np.bool_)
+    if kind == "float":
+        return np.array(
+            [np.nan if v in MISSING else float(v) for v in values], dtype=np.float64
+        )
+    return np.array(["" if v in MISSING else v for v in values], dtype=np.str_)
+
+
+# Read one session CSV into a dict of typed column arrays
+def read_session(path):
+    task, subject, condition, session = parse_csv_name(path)
+    with open(path, newline="") as csv_file:
+        reader = csv.DictReader(csv_file)
+        rows = list(reader)
+        fieldnames = reader.fieldnames or []
+
+    schema = SCHEMAS[task]
+    columns = {}
+    for name in fieldnames:
+        values = [row[name] or "" for row in rows]
+        try:
+            columns[name] = _column(values, schema.get(name, "str"))
+        except ValueError as e:
+            raise ValueError(f"{path}: column '{name}': {e}") from None
+
+    # The memory tasks do not write the subject code, it is in the file name;
+    # every session gets the same three columns so partitions concatenate
+    n_rows = len(rows)
+    columns["Subject Code"] = np.array([subject] * n_rows, dtype=np.str_)
+    columns["Condition"] = np.array([condition] * n_rows, dtype=np.str_)
+    columns["Session"] = np.array([session] * n_rows, dtype=np.str_)
+    return task, subject, condition, session, columns
+
+
+def partition_path(store_folder, task, subject, condition):
+    return os.path.join(store_folder, task, subject, f"{condition}.npz")
+
+
+# Empty values for a column a session does not have (older CSVs)
+def _missing_column(task, name, n_rows):
+    kind = SCHEMAS[task].get(name, "str")
+    # Missing integers can only be represented as NaN
+    kind = "float" if kind == "int" else kind
+    return _column([""] * n_rows, kind)
+
+
+# Concatenate the columns of several sessions (dicts of arrays), filling the
+# columns some of them lack
+def merge_columns(task, parts):
+    names = []
+    for part in parts:
+        names += [name for name in part if name not in names]
+    merged = {}
+    for name in names:
+        merged[name] = np.concatenate(
+            [
+                part[name]
+                if name in part
+                else _missing_column(task, name, len(part["Session"]))
+                for part in parts
+            ]
+        )
+    return merged
+
+
+# All the columns of a partition, or None if it does not exist yet
+def read_partition(part):
+    if not os.path.exists(part):
+        return None
+    with np.load(part, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+def load_registry(store_folder):
+    registry_path = os.path.join(store_folder, REGISTRY_NAME)
+    if not os.path.exists(registry_path):
+        return {}
+    with open(registry_path) as registry_file:
+        return json.load(registry_file)
+
+
+def write_registry(store_folder, registry):
+    registry_path = os.path.join(store_folder, REGISTRY_NAME)
+    with open(registry_path + ".tmp", "w") as registry_file:
+        json.dump(registry, registry_file, indent=1, sort_keys=True)
+    os.replace(registry_path + ".tmp", registry_path)
+
+
+# Add new or changed session CSVs to the store. Returns the number of
+# sessions written and the CSVs that could not be read.
+def ingest(csv_paths, store_folder=STORE_FOLDER):
+    os.makedirs(store_folder, exist_ok=True)
+    registry = load_registry(store_folder)
+    written = 0
+    problems = []
+    # New sessions by partition: (registry key, stat, session, columns)
+    pending = {}
+
+    for path in sorted(csv_paths):
+        if parse_csv_name(path) is None:
+            continue
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        entry = registry.get(key)
+        if (
+            entry is not None
+            and entry["size"] == stat.st_size
+            and entry["mtime"] == stat.st_mtime
+        ):
+            continue
+
+        try:
+            task, subject, condition, session, columns = read_session(path)
+        except (ValueError, KeyError, csv.Error) as e:
+            problems.append(f"{path}: {e}")
+            continue
+
+        part = partition_path(store_folder, task, subject, condition)
+        pending.setdefault((part, task), []).append((key, stat, session, columns))
+
+    for (part, task), sessions in pending.items():
+        # Earlier rows of the same sessions (CSVs that grew) are replaced
+        new_sessions = [session for _, _, session, _ in sessions]
+        parts = []
+        old = read_partition(part)
+        if old is not None:
+            keep = ~np.isin(old["Session"], new_sessions)
+            parts.append({name: values[keep] for name, values in old.items()})
+        parts += [columns for _, _, _, columns in sessions]
+        merged = merge_columns(task, parts)
+        order = np.argsort(merged["Session"], kind="stable")
+        merged = {name: values[order] for name, values in merged.items()}
+
+        os.makedirs(os.path.dirname(part), exist_ok=True)
+        # Write under a temporary name, so an interrupted ingest never leaves
+        # a truncated partition behind
+        with open(part + ".tmp", "wb") as part_file:
+            np.savez(part_file, **merged)
+        os.replace(part + ".tmp", part)
+
+        for key, stat, _, columns in sessions:
+            registry[key] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "rows": len(columns["Session"]),
+                "partition": os.path.relpath(part, store_folder),
+            }
+            written += 1
+
+    write_registry(store_folder, registry)
+    return written, problems
+
+
+def partitions(store_folder, task, subjects=None, conditions=None):
+    paths = glob.glob(os.path.join(store_folder, task, "*", "*.npz"))
+    selected = []
+    for path in sorted(paths):
+        subject = os.path.basename(os.path.dirname(path))
+        condition = os.path.basename(path)[: -len(".npz")]
+        if subjects is not None and subject not in subjects:
+            continue
+        if conditions is not None and condition not in conditions:
+            continue
+        selected.append(path)
+    return selected
+
+
+# Concatenate columns across sessions, e.g.
+#   load("prl", columns=["Subject Code", "Reaction Time"], conditions=["A"])
+# Only the requested columns are read from each partition; sessions that
+# lack a column (older CSVs) get empty values for it.
+def load(
+    task, columns=None, subjects=None, conditions=None, store_folder=STORE_FOLDER
+):
+    arrays = {}
+    paths = partitions(store_folder, task, subjects, conditions)
+    for path in paths:
+        with np.load(path, allow_pickle=False) as part:
+            names = part.files if columns is None else columns
+            n_rows = len(part["Session"])
+            for name in names:
+                if name in part.files:
+                    values = part[name]
+                else:
+                    values = _missing_column(task, name, n_rows)
+                arrays.setdefault(name, []).append(values)
+    return {name: np.concatenate(values) for name, values in arrays.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Consolidate session CSVs into a typed columnar store"
+    )
+    parser.add_argument(
+        "folders",
+        nargs="*",
+        default=["."],
+        help="folders containing the session CSVs (default: current folder)",
+    )
+    parser.add_argument("--store", default=STORE_FOLDER, help="store folder")
+    args = parser.parse_args()
+
+    csv_paths = []
+    for folder in args.folders:
+        csv_paths += glob.glob(os.path.join(folder, "*.csv"))
+    written, problems = ingest(csv_paths, args.store)
+    for problem in problems:
+        print(problem)
+    print(f"{written} sessions added to {args.store}")
@@ -0,0 +1,258 @@
+import argparse
+import csv
+import os
+import time
+import numpy as np
+import rl_models
+from prl_schedule import (
+    N_EPOCHS,
+    TRIALS_PER_EPOCH,
+    IMAGE_RANGES,
+    VIDEO_TYPES,
+    FIELDNAMES,
+    reward_probabilities,
+    most_rewarded_stimulus,
+    is_video_trial,
+)
+
+# Synthetic agents playing the PRL schedule of prl_30.py: the same epochs,
+# reversal, reward probabilities, image order and orange_first
+# counterbalancing, with choices made by one of the models in rl_models.
+# Agents are simulated in batches of NumPy arrays (one row per agent), so
+# the only Python loop is over the 50 trials.
+CHUNK_AGENTS = 100_000
+
+# Range of the parameters drawn when they are not fixed
+PARAM_RANGES = {
+    "alpha": (0.05, 0.95),
+    "alpha_pos": (0.05, 0.95),
+    "alpha_neg": (0.05, 0.95),
+    "beta": (1.0, 15.0),
+}
+
+N_TRIALS = N_EPOCHS * TRIALS_PER_EPOCH
+
+
+# Per-trial flags of the schedule, shape (N_TRIALS,)
+def schedule():
+    trials = np.arange(N_TRIALS)
+    epochs = trials // TRIALS_PER_EPOCH
+    video = np.array([is_video_trial(t % TRIALS_PER_EPOCH) for t in trials])
+    return epochs, video
+
+
+# Simulate one batch of agents. params maps the model's parameter names to
+# arrays of shape (n_agents,); orange_first is a boolean array.
+def simulate(model, params, orange_first, rng):
+    n_agents = len(orange_first)
+    alpha_pos = params.get("alpha_pos", params.get("alpha"))
+    alpha_neg = params.get("alpha_neg", params.get("alpha"))
+    beta = params["beta"]
+    counterfactual = model == "reversal"
+    epochs, _ = schedule()
+
+    # (agent, epoch, colour) reward probabilities
+    probabilities = np.where(
+        orange_first[:, None, None],
+        np.array(reward_probabilities(True)),
+        np.array(reward_probabilities(False)),
+    )
+
+    values = np.full((n_agents, 2), rl_models.INITIAL_VALUE)
+    choices = np.zeros((n_agents, N_TRIALS), dtype=np.int8)
+    rewards = np.zeros((n_agents, N_TRIALS), dtype=np.bool_)
+    agents = np.arange(n_agents)
+
+    for t in range(N_TRIALS):
+        p_white = 1 / (1 + np.exp(-beta * (values[:, 1] - values[:, 0])))
+        choice = (rng.random(n_agents) < p_white).astype(np.int8)
+        reward = rng.random(n_agents) < probabilities[agents, epochs[t], choice]
+        rl_models.update_values(
+            values, choice, reward, alpha_pos, alpha_neg, counterfactual
+        )
+        choices[:, t] = choice
+        rewards[:, t] = reward
+
+    # As in prl_30.py: the images of each epoch in a random order, and the
+    # orange image on a random side in every trial
+    image_index = np.concatenate(
+        [
+            np.argsort(rng.random((n_agents, TRIALS_PER_EPOCH)), axis=1)
+            + epoch * TRIALS_PER_EPOCH
+            for epoch in range(N_EPOCHS)
+        ],
+        axis=1,
+    ).astype(np.int16)
+    orange_left = rng.random((n_agents, N_TRIALS)) < 0.5
+
+    return {
+        "choices": choices,
+        "rewards": rewards,
+        "image_index": image_index,
+        "orange_left": orange_left,
+        "orange_first": orange_first,
+    }
+
+
+# Simulate any number of agents in chunks of CHUNK_AGENTS
+def simulate_agents(model, params, orange_first, seed=None):
+    rng = np.random.default_rng(seed)
+    chunks = []
+    for start in range(0, len(orange_first), CHUNK_AGENTS):
+        end = start + CHUNK_AGENTS
+        chunk_params = {name: values[start:end] for name, values in params.items()}
+        chunks.append(simulate(model, chunk_params, orange_first[start:end], rng))
+    return {name: np.concatenate([c[name] for c in chunks]) for name in chunks[0]}
+
+
+# Parameters of n agents: fixed values where given, otherwise uniform draws
+# from PARAM_RANGES
+def draw_params(model, n_agents, fixed, rng):
+    params = {}
+    for name in rl_models.MODELS[model]:
+        if name in fixed:
+            params[name] = np.full(n_agents, float(fixed[name]))
+        else:
+            params[name] = rng.uniform(*PARAM_RANGES[name], size=n_agents)
+    return params
+
+
+# Trial columns in the schema of the prl_30.py CSV (plus "Session", as in
+# session_store), one row per agent and trial. Columns that only exist in
+# the lab (reaction times, mood ratings, video and display timing) are empty.
+def to_columns(result, condition_code="A", subject_prefix="sim"):
+    n_agents = len(result["orange_first"])
+    n_rows = n_agents * N_TRIALS
+    epochs, video = schedule()
+    start = IMAGE_RANGES[condition_code][0]
+
+    choices = result["choices"].ravel()
+    orange_left = result["orange_left"].ravel()
+    orange_first = np.repeat(result["orange_first"], N_TRIALS)
+    agent_ids = np.repeat(np.arange(n_agents), N_TRIALS).astype(str)
+    numbers = np.char.zfill((result["image_index"].ravel() + start).astype(str), 3)
+    orange_files = np.char.add(np.char.add("old_orange_img_", numbers), ".png")
+    white_files = np.char.add(np.char.add("old_white_img_", numbers), ".png")
+    chosen_left = (choices == 0) == orange_left
+    most_rewarded = np.array(
+        [
+            [most_rewarded_stimulus(epoch, first) for epoch in epochs]
+            for first in (False, True)
+        ]
+    )
+    empty = np.full(n_rows, np.nan)
+
+    return {
+        "Subject Code": np.char.add(f"{subject_prefix}_", agent_ids),
+        "Condition": np.full(n_rows, condition_code),
+        "Trial Number": np.tile(np.arange(1, N_TRIALS + 1), n_agents),
+        "Epoch": np.tile(epochs + 1, n_agents),
+        "Chosen Color": np.where(choices == 1, "White", "Orange"),
+        "Orange First": orange_first,
+        "Stimulus Position": np.where(orange_left, "Left", "Right"),
+        "Key Pressed": np.where(chosen_left, "Left", "Right"),
+        "Reaction Time": empty,
+        "Feedback Received": result["rewards"].ravel(),
+        "Chosen Image": np.where(choices == 1, white_files, orange_files),
+        "Most Rewarded Stimulus in Epoch": most_rewarded[
+            result["orange_first"].astype(int)
+        ].ravel(),
+        "Image Left": np.where(orange_left, orange_files, white_files),
+        "Image Right": np.where(orange_left, white_files, orange_files),
+        "Mood Slider Value": empty,
+        "Video Type": np.full(n_rows, VIDEO_TYPES[condition_code]),
+        "Video File Name": np.tile(np.where(video, "simulated", ""), n_agents),
+        "Video Frames Dropped": empty,
+        "Video Frames Late": empty,
+        "Stimulus Onset (ns)": empty,
+        "Response Time (ns)": empty,
+        "Flip Latency (ms)": empty,
+        "Audio Onset Latency (ms)": empty,
+        "Seed": empty,
+        "Session": np.full(n_rows, "simulated"),
+    }
+
+
+# One experiment_data_<agent>_<condition>_<session>.csv per agent, named
+# like the files of prl_30.py so that session_store can ingest them
+def write_csvs(folder, columns, session="00000000_000000"):
+    os.makedirs(folder, exist_ok=True)
+    n_rows = len(columns["Trial Number"])
+    condition_code = columns["Condition"][0]
+    for start in range(0, n_rows, N_TRIALS):
+        subject = columns["Subject Code"][start]
+        filename = os.path.join(
+            folder, f"experiment_data_{subject}_{condition_code}_{session}.csv"
+        )
+        with open(filename, mode="w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(FIELDNAMES)
+            for row in range(start, start + N_TRIALS):
+                writer.writerow(
+                    [
+                        "" if isinstance(v, float) and np.isnan(v) else v
+                        for v in (columns[name][row].item() for name in FIELDNAMES)
+                    ]
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Simulate RL agents on the PRL schedule"
+    )
+    parser.add_argument("--agents", type=int, default=10000)
+    parser.add_argument("--model", choices=sorted(rl_models.MODELS), default="rw")
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="fix a parameter (otherwise drawn uniformly for every agent)",
+    )
+    parser.add_argument("--condition", choices=sorted(IMAGE_RANGES), default="A")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--output", default="simulation.npz")
+    parser.add_argument("--csv-folder", help="also write one CSV per agent")
+    parser.add_argument(
+        "--recover",
+        action="store_true",
+        help="fit the model to the simulated choices and compare the parameters",
+    )
+    parser.add_argument("--workers", type=int, help="processes used by --recover")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    fixed = dict(param.split("=", 1) for param in args.param)
+    params = draw_params(args.model, args.agents, fixed, rng)
+    # Counterbalancing as in the experiment: half of the agents start with
+    # orange as the most rewarded colour
+    orange_first = np.arange(args.agents) % 2 == 0
+
+    start_time = time.time()
+    result = simulate_agents(args.model, params, orange_first, rng.integers(2**32))
+    print(f"Simulated {args.agents} agents in {time.time() - start_time:.1f} s")
+    np.savez(
+        args.output,
+        **result,
+        **{f"true_{name}": values for name, values in params.items()},
+    )
+
+    if args.csv_folder:
+        write_csvs(args.csv_folder, to_columns(result, args.condition))
+
+    if args.recover:
+        data = {
+            "choices": result["choices"],
+            "rewards": result["rewards"].astype(np.float64),
+            "mask": np.ones(result["choices"].shape, dtype=np.bool_),
+        }
+        start_time = time.time()
+        fitted = rl_models.fit(args.model, data, workers=args.workers)
+        print(
+            f"Fitted {args.agents} agents in {time.time() - start_time:.1f} s, "
+            f"{int(np.sum(~fitted['converged']))} did not converge"
+        )
+        for name, true_values in params.items():
+            if np.ptp(true_values) > 0:
+                r = np.corrcoef(true_values, fitted["params"][name])[0, 1]
+                print(f"{name}: r = {r:.3f}")
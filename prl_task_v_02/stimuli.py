@@ -0,0 +1,159 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pygame
+from bundle import load_image
+
+# PNG inflation in pygame.image.load releases the GIL, so a small thread pool
+# decodes images in parallel
+LOADER_THREADS = 8
+
+
+# Largest part of a screen half (or of the screen, for centred images) that
+# a stimulus may cover before it is scaled down
+MAX_STIMULUS_FRACTION = 0.9
+
+
+# Whether an opaque surface already has the pixel layout of the display
+def _in_display_format(surface):
+    display = pygame.display.get_surface()
+    return (
+        display is not None
+        and not surface.get_flags() & pygame.SRCALPHA
+        and surface.get_bitsize() == display.get_bitsize()
+        and surface.get_masks()[:3] == display.get_masks()[:3]
+    )
+
+
+# Convert a surface to the pixel format of the display, keeping per-pixel
+# alpha when the image has it, so that blitting it needs no per-pixel
+# conversion. Optionally scale it down to fit inside max_size. Needs a
+# display mode set.
+def prepare_surface(surface, max_size=None):
+    if surface.get_flags() & pygame.SRCALPHA:
+        surface = surface.convert_alpha()
+    elif not _in_display_format(surface):
+        surface = surface.convert()
+
+    if max_size is not None:
+        width, height = surface.get_size()
+        scale = min(max_size[0] / width, max_size[1] / height)
+        if scale < 1:
+            new_size = (int(width * scale), int(height * scale))
+            surface = pygame.transform.smoothscale(surface, new_size)
+    return surface
+
+
+# Load an image, from the subject's stimulus bundle if there is one, and
+# prepare it for the display
+def load_surface(path, max_size=None):
+    return prepare_surface(load_image(path), max_size)
+
+
+# Screen geometry of the tasks: two stimuli centred in the left and right
+# halves of the screen, and feedback or fixation in the centre. Blit
+# positions are computed once per slot and image size.
+class StimulusLayout:
+    def __init__(self, screen_size):
+        self.screen_width, self.screen_height = screen_size
+        self.centres = {
+            "left": (self.screen_width // 4, self.screen_height // 2),
+            "right": (3 * self.screen_width // 4, self.screen_height // 2),
+            "center": (self.screen_width // 2, self.screen_height // 2),
+        }
+        self.positions = {}
+
+    # Largest size a stimulus may have in one half of the screen
+    def max_stimulus_size(self):
+        return (
+            int(self.screen_width / 2 * MAX_STIMULUS_FRACTION),
+            int(self.screen_height * MAX_STIMULUS_FRACTION),
+        )
+
+    # Top-left corner that centres an image of the given size in a slot
+    def position(self, slot, size):
+        key = (slot, size)
+        if key not in self.positions:
+            centre_x, centre_y = self.centres[slot]
+            self.positions[key] = (centre_x - size[0] // 2, centre_y - size[1] // 2)
+        return self.positions[key]
+
+    def blit(self, screen, surface, slot):
+        screen.blit(surface, self.position(slot, surface.get_size()))
+
+
+# Load a list of images on a thread pool. Images are decoded either all at
+# once with load_all(), or on demand with prefetch() and get(). Loaders can
+# share one executor by passing it in.
+class StimulusLoader:
+    def __init__(
+        self, paths, executor=None, max_workers=LOADER_THREADS, max_size=None
+    ):
+        self.paths = list(paths)
+        self.executor = executor or ThreadPoolExecutor(max_workers=max_workers)
+        self.max_size = max_size
+        self.futures = {}
+
+    # Start decoding the given images in the background (or take them from
+    # prefetch_images())
+    def prefetch(self, indices):
+        for index in indices:
+            if index not in self.futures:
+                future = _prefetched.get(os.path.normpath(self.paths[index]))
+                self.futures[index] = future or self.executor.submit(
+                    load_surface, self.paths[index], self.max_size
+                )
+
+    # Return one image, waiting for it to be decoded if needed
+    def get(self, index):
+        self.prefetch([index])
+        return self.futures[index].result()
+
+    def load_all(self):
+        start_time = time.perf_counter()
+        self.prefetch(range(len(self.paths)))
+        images = [self.get(index) for index in range(len(self.paths))]
+        print(
+            f"Loaded {len(images)} images in {time.perf_counter() - start_time:.2f} s"
+        )
+        return images
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, index):
+        return self.get(index)
+
+
+# Images prepared ahead of time by prefetch_images(), by path. run_session.py
+# decodes the next condition's stimuli on one background thread while the
+# current condition runs; StimulusLoader and prefetched_image() take them
+# from here until discard_prefetched() drops them.
+_prefetched = {}
+_prefetch_executor = None
+
+
+def prefetch_images(paths, max_size=None):
+    global _prefetch_executor
+    if _prefetch_executor is None:
+        _prefetch_executor = ThreadPoolExecutor(max_workers=1)
+    for path in paths:
+        path = os.path.normpath(path)
+        if path not in _prefetched:
+            _prefetched[path] = _prefetch_executor.submit(load_surface, path, max_size)
+
+
+# A prefetched image, waiting for it if it is still being decoded, or None
+def prefetched_image(path):
+    future = _prefetched.get(os.path.normpath(path))
+    return future.result() if future is not None else None
+
+
+def discard_prefetched(paths):
+    for path in paths:
+        future = _prefetched.pop(os.path.normpath(path), None)
+        if future is not None:
+            future.cancel()
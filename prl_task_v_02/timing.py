@@ -0,0 +1,62 @@
+import time
+import pygame
+
+# All task timestamps come from time.perf_counter_ns(): a monotonic clock
+# with sub-microsecond resolution that, unlike time.time(), never jumps when
+# the wall clock is adjusted.
+
+# Shortest flip interval taken as a sign of vsync: one refresh even at 240 Hz
+# (4.2 ms), while an unsynchronised flip returns in well under a millisecond
+VSYNC_MIN_INTERVAL_NS = 4_000_000
+
+
+def clock_resolution_ns():
+    return time.get_clock_info("perf_counter").resolution * 1e9
+
+
+# Open the window, asking for flips synchronised to the vertical blank.
+# pygame only offers vsync together with SCALED or OPENGL, so with vsync the
+# window is SCALED (a fullscreen window then goes through SDL's renderer).
+# Returns the screen and whether vsync was requested and accepted by
+# set_mode; the renderer may still ignore it, see vsync_active().
+def set_mode(size, flags=0, vsync=True):
+    if vsync:
+        try:
+            return pygame.display.set_mode(size, flags | pygame.SCALED, vsync=1), True
+        except pygame.error:
+            pass
+    return pygame.display.set_mode(size, flags), False
+
+
+# Whether flips actually wait for the vertical blank: the median interval
+# between a few consecutive flips is at least one refresh with vsync. Always
+# False with the dummy driver of headless runs.
+def vsync_active(flips=7):
+    if pygame.display.get_driver() == "dummy":
+        return False
+    stamps = []
+    for _ in range(flips):
+        pygame.display.flip()
+        stamps.append(time.perf_counter_ns())
+    intervals = sorted(b - a for a, b in zip(stamps, stamps[1:]))
+    return intervals[len(intervals) // 2] >= VSYNC_MIN_INTERVAL_NS
+
+
+# Flip the display and return the onset timestamp and how long the flip
+# took, both in ns. With vsync, flip() returns once the new frame is on its
+# way to the screen, so the timestamp taken right after it is the onset.
+def flip():
+    before = time.perf_counter_ns()
+    pygame.display.flip()
+    onset = time.perf_counter_ns()
+    return onset, onset - before
+
+
+# Timing columns of a response: stimulus onset and response timestamps (ns),
+# and the time the onset flip took (ms)
+def response_timing(onset_ns, flip_latency_ns, response_ns):
+    return {
+        "Stimulus Onset (ns)": onset_ns,
+        "Response Time (ns)": response_ns,
+        "Flip Latency (ms)": flip_latency_ns / 1e6,
+    }
@@ -0,0 +1,87 @@
+import atexit
+import csv
+import os
+import queue
+import threading
+import time
+
+# Rows are flushed to the operating system as soon as they are written, and
+# forced to disk with fsync every FSYNC_EVERY rows or FSYNC_INTERVAL seconds
+FSYNC_EVERY = 5
+FSYNC_INTERVAL = 1.0
+
+_STOP = object()
+
+
+# Background CSV writer. The trial loop hands rows over with log(), which
+# only puts a copy of the row on a queue and never blocks; a thread writes
+# them in order through one file handle that stays open for the session.
+# close() drains the queue and is also run at interpreter exit, so rows
+# logged before safe_exit() are never lost. If writing fails (a bad row, an
+# I/O error) the thread stops, and the error is raised again by the next
+# log() and by close(), so a session never goes on without its data.
+class TrialLogger(threading.Thread):
+    def __init__(self, filename, fieldnames, defaults=None):
+        super().__init__(daemon=True)
+        self.filename = filename
+        self.defaults = dict(defaults or {})
+        self.queue = queue.Queue()
+        self.file = open(filename, "a", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+        if self.file.tell() == 0:
+            self.writer.writeheader()  # Write the header only if the file is new
+            self.file.flush()
+        self.closed = False
+        self.error = None
+        self.start()
+        atexit.register(self.close)
+
+    # Queue a row; values in defaults (e.g. subject and condition) are added
+    # to a copy of the row, the caller's dict is left untouched
+    def log(self, row):
+        if self.error is not None:
+            raise self.error
+        self.queue.put({**self.defaults, **row})
+
+    def run(self):
+        try:
+            self._write_rows()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.file.close()
+
+    def _write_rows(self):
+        unsynced = 0
+        last_sync = time.monotonic()
+        while True:
+            try:
+                row = self.queue.get(timeout=FSYNC_INTERVAL)
+            except queue.Empty:
+                row = None
+            if row is _STOP:
+                break
+            if row is not None:
+                self.writer.writerow(row)
+                self.file.flush()
+                unsynced += 1
+            if unsynced and (
+                unsynced >= FSYNC_EVERY
+                or time.monotonic() - last_sync >= FSYNC_INTERVAL
+            ):
+                os.fsync(self.file.fileno())
+                unsynced = 0
+                last_sync = time.monotonic()
+
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    # Write every queued row, sync the file and stop the writer thread
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(_STOP)
+        self.join()
+        if self.error is not None:
+            raise self.error
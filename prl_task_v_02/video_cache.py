@@ -0,0 +1,157 @@
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from video_player import resolve_video
+
+# Default memory budget for cached clips (in MB)
+DEFAULT_BUDGET_MB = 1024
+
+# JPEG quality of the cached frames
+JPEG_QUALITY = 90
+
+
+# A clip kept in memory as one JPEG packet per frame, already scaled to the
+# screen. Raw RGB frames would take width * height * 3 bytes each (about 1 GB
+# per clip at 1024x768, 2.8 GB at 1920x1080), more than the whole budget;
+# the packets take a few tens of MB. They are decoded on the decoder thread
+# of video_player like a video file, through capture().
+class CachedClip:
+    def __init__(self, packets, fps, size):
+        self.packets = packets
+        self.fps = fps
+        self.size = size
+        self.nbytes = sum(packet.nbytes for packet in packets)
+
+    def capture(self):
+        return PacketCapture(self)
+
+
+# Minimal stand-in for cv2.VideoCapture over the packets of a CachedClip
+class PacketCapture:
+    def __init__(self, clip):
+        self.clip = clip
+        self.position = 0
+
+    def isOpened(self):
+        return True
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.clip.fps
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.clip.size[0]
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.clip.size[1]
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return len(self.clip.packets)
+        return 0
+
+    def read(self, frame=None):
+        if self.position >= len(self.clip.packets):
+            return False, None
+        packet = self.clip.packets[self.position]
+        self.position += 1
+        return True, cv2.imdecode(packet, cv2.IMREAD_COLOR)
+
+    def release(self):
+        pass
+
+
+# Decode a whole clip, scale it to the screen and encode every frame as JPEG.
+# Returns None (and the fps) when the clip cannot be opened or its packets
+# would take more than max_bytes.
+def encode_clip(video_path, size, max_bytes=None):
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None, 0
+    width, height = size
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    resize_needed = (
+        cap.get(cv2.CAP_PROP_FRAME_WIDTH) != width
+        or cap.get(cv2.CAP_PROP_FRAME_HEIGHT) != height
+    )
+    resized = np.empty((height, width, 3), dtype=np.uint8)
+    params = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+    packets = []
+    nbytes = 0
+    frame = None
+    try:
+        while True:
+            ret, frame = cap.read(frame)
+            if not ret:
+                break
+            if resize_needed:
+                cv2.resize(frame, (width, height), dst=resized)
+                ok, packet = cv2.imencode(".jpg", resized, params)
+            else:
+                ok, packet = cv2.imencode(".jpg", frame, params)
+            if not ok:
+                return None, fps
+            packets.append(packet)
+            nbytes += packet.nbytes
+            if max_bytes is not None and nbytes > max_bytes:
+                return None, fps
+    finally:
+        cap.release()
+
+    if not packets:
+        return None, fps
+    return CachedClip(packets, fps, size), fps
+
+
+# Cache of encoded clips with a memory budget and least-recently-used
+# eviction. Clips are encoded lazily on first use, or up front with preload().
+# A clip that cannot be opened or does not fit is remembered, with a warning,
+# so that it is streamed from disk without being decoded again for nothing.
+class VideoCache:
+    def __init__(self, size, budget_mb=DEFAULT_BUDGET_MB):
+        self.size = size
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.clips = OrderedDict()  # video_path -> CachedClip
+        self.rejected = set()
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def _evict_for(self, nbytes):
+        while self.clips and self.used + nbytes > self.budget:
+            _, clip = self.clips.popitem(last=False)
+            self.used -= clip.nbytes
+
+    # Return the CachedClip of a video, encoding it if needed. Returns None
+    # when the clip cannot be opened or does not fit in the budget, in which
+    # case the caller should stream it from disk instead. With evict=False
+    # the clip is only kept if it fits next to the clips already cached.
+    # Clips are keyed by their pre-scaled copy when there is one (see
+    # resolve_video), so a clip preloaded by its original path is found again
+    # when it is played.
+    def get(self, video_path, evict=True):
+        video_path = resolve_video(video_path, self.size)
+        with self.lock:
+            if video_path in self.clips:
+                self.clips.move_to_end(video_path)
+                return self.clips[video_path]
+            if video_path in self.rejected:
+                return None
+
+            max_bytes = self.budget if evict else self.budget - self.used
+            clip, _ = encode_clip(video_path, self.size, max_bytes=max_bytes)
+            if clip is None:
+                if evict:
+                    # Too big for the whole budget (or unreadable): never
+                    # worth trying again
+                    self.rejected.add(video_path)
+                print(
+                    f"Warning: {video_path} cannot be kept in the video cache "
+                    f"({self.budget / 2**20:.0f} MB), streaming it from disk"
+                )
+                return None
+            self._evict_for(clip.nbytes)
+            self.clips[video_path] = clip
+            self.used += clip.nbytes
+            return clip
+
+    # Encode clips at startup, without evicting the ones already preloaded
+    def preload(self, video_paths):
+        for video_path in video_paths:
+            self.get(video_path, evict=False)
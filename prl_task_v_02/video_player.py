@@ -0,0 +1,180 @@
+import os
+import threading
+import queue
+import time
+import cv2
+import numpy as np
+import pygame
+from prepare_videos import load_manifest, size_folder
+
+# Number of decoded frames the decoder thread may run ahead of the presenter
+FRAME_QUEUE_SIZE = 8
+
+
+# Thread that decodes a video into a fixed ring of preallocated RGB frame
+# buffers. Frames are resized and colour-converted into the ring through
+# dst= buffers, so decoding allocates no new arrays once playback starts.
+# Each slot is wrapped once in a Surface that shares its memory, which is
+# what the presenter blits. source is a video path or an object with the
+# interface of cv2.VideoCapture (e.g. a clip of the video cache).
+class FrameDecoder(threading.Thread):
+    def __init__(self, source, size, queue_size=FRAME_QUEUE_SIZE):
+        super().__init__(daemon=True)
+        if isinstance(source, str):
+            source = cv2.VideoCapture(source)
+        self.cap = source
+        self.size = size
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) if self.cap.isOpened() else 0
+        width, height = size
+        self.slots = np.empty((queue_size, height, width, 3), dtype=np.uint8)
+        self.resized = np.empty((height, width, 3), dtype=np.uint8)
+        self.surfaces = [wrap_frame(slot) for slot in self.slots]
+        self.free = queue.Queue()
+        for slot in range(queue_size):
+            self.free.put(slot)
+        self.frames = queue.Queue()
+        self.stop_event = threading.Event()
+
+    def is_opened(self):
+        return self.cap.isOpened()
+
+    def run(self):
+        width, height = self.size
+        resize_needed = (
+            self.cap.get(cv2.CAP_PROP_FRAME_WIDTH) != width
+            or self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT) != height
+        )
+        frame = None
+        try:
+            while not self.stop_event.is_set():
+                slot = self._get_free_slot()
+                if slot is None:
+                    break
+                ret, frame = self.cap.read(frame)
+                if not ret:
+                    break
+                if resize_needed:
+                    cv2.resize(frame, (width, height), dst=self.resized)
+                    cv2.cvtColor(self.resized, cv2.COLOR_BGR2RGB, dst=self.slots[slot])
+                else:
+                    cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.slots[slot])
+                self.frames.put(slot)
+        finally:
+            self.cap.release()
+            self.frames.put(None)  # End-of-stream marker for the presenter
+
+    # Wait for the presenter to hand back a slot, unless we are stopped
+    def _get_free_slot(self):
+        while not self.stop_event.is_set():
+            try:
+                return self.free.get(timeout=0.05)
+            except queue.Empty:
+                continue
+        return None
+
+    # Yield decoded frames (as the Surfaces of their slots) in order until the
+    # end of the stream. A slot goes back to the decoder once the presenter
+    # asks for the next frame.
+    def __iter__(self):
+        while True:
+            slot = self.frames.get()
+            if slot is None:
+                return
+            yield self.surfaces[slot]
+            self.free.put(slot)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+# A Surface over a contiguous RGB frame of shape (height, width, 3), sharing
+# its memory (no copy): blitting it is one row-wise copy, where writing the
+# frame through surfarray.pixels3d is strided on both sides
+def wrap_frame(frame):
+    height, width = frame.shape[:2]
+    return pygame.image.frombuffer(frame, (width, height), "RGB")
+
+
+# Draw a frame (a Surface, or an RGB array of the screen size) over the whole
+# screen
+def upload_frame(screen, frame):
+    if not isinstance(frame, pygame.Surface):
+        frame = wrap_frame(frame)
+    screen.blit(frame, (0, 0))
+
+
+# Present frames against a monotonic clock, dropping frames that are too late.
+# Frame i is due at start + i / fps: a frame that is more than one frame
+# interval overdue is skipped (dropped), one shown after its due time is late.
+# Frames are screen-sized Surfaces or RGB arrays blitted onto the display.
+# With paced=False every frame is shown as soon as it is decoded (headless
+# runs), so nothing is dropped or late.
+def present_frames(screen, frames, fps, on_frame=None, paced=True):
+    stats = {"frames": 0, "dropped": 0, "late": 0}
+    frame_interval = 1.0 / fps if fps and fps > 0 else 1.0 / 25
+    start = None
+
+    for index, frame in enumerate(frames):
+        if start is None:
+            start = time.perf_counter()
+        due = start + index * frame_interval
+        now = time.perf_counter()
+
+        if paced:
+            if now - due > frame_interval:
+                stats["dropped"] += 1
+                continue
+            if now < due:
+                time.sleep(due - now)
+            elif now - due > 0.001:
+                stats["late"] += 1
+
+        upload_frame(screen, frame)
+        pygame.display.flip()
+        stats["frames"] += 1
+
+        if on_frame is not None:
+            on_frame()
+
+    return stats
+
+
+# Pre-scaled video manifests, loaded once per display size
+_manifests = {}
+
+
+# Return the pre-scaled copy of a video made by prepare_videos.py for this
+# display size, or the original path when there is no up-to-date copy
+def resolve_video(video_path, size):
+    if size not in _manifests:
+        _manifests[size] = load_manifest(size)
+    manifest = _manifests[size]
+    if manifest is None:
+        return video_path
+
+    entry = manifest["videos"].get(video_path)
+    if entry is None or not os.path.exists(video_path):
+        return video_path
+    if entry["source_mtime"] != os.path.getmtime(video_path):
+        return video_path  # The source changed after it was transcoded
+    return os.path.join(size_folder(size), entry["file"])
+
+
+# Present a video on the screen, decoding it on a background thread from the
+# cache when one is given and the clip fits in it, otherwise from disk
+def play_video_file(screen, video_path, on_frame=None, cache=None, paced=True):
+    clip = cache.get(video_path) if cache is not None else None
+    if clip is not None:
+        source = clip.capture()
+    else:
+        source = resolve_video(video_path, screen.get_size())
+    decoder = FrameDecoder(source, screen.get_size())
+    if not decoder.is_opened():
+        return None
+    decoder.start()
+    try:
+        stats = present_frames(screen, decoder, decoder.fps, on_frame, paced)
+    finally:
+        decoder.stop()
+    return stats